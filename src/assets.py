@@ -1,10 +1,14 @@
 import asyncio
+import io
 import json
 import os
 import requests
 import shutil
+import tarfile
+import uuid
 import zipfile
 
+from downloads import DownloadCache
 from pathlib import Path
 from urllib import parse, request
 
@@ -13,8 +17,56 @@ class AssetUploadError(Exception):
     pass
 
 
+class AssetHydrationError(Exception):
+    pass
+
+
+class MultipartFile:
+    def __init__(self, fields: dict, name: str, filename: str, path: str):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+        head = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'
+            for key, value in fields.items()
+        )
+        head += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+            f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'
+        )
+        tail = f"\r\n--{boundary}--\r\n"
+
+        self.length = len(head.encode()) + os.path.getsize(path) + len(tail.encode())
+        self.file = open(path, "rb")
+        self.parts = [io.BytesIO(head.encode()), self.file, io.BytesIO(tail.encode())]
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size: int = -1):
+        # Parts are read in order, so the file is sent in chunks instead of held in memory
+        chunks = []
+        while self.parts and (size < 0 or size > 0):
+            chunk = self.parts[0].read(size)
+            if not chunk:
+                self.parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        self.file.close()
+
+
 class Asset:
     assets_path = "assets"
+    archive_name = "saga.tar"
+    archive_folders = ["images", "sparse", "features", "saga"]
+    archive_excludes = ["saga/segmentation", "saga/results"]
+    source_marker = ".input-source"
+    download_cache: DownloadCache = None
 
     def __init__(
         self, asset_id: str, images_path: str, pcl_path: str, storage_root: str
@@ -22,6 +74,9 @@ class Asset:
         self.storage_root = storage_root
         self.asset_id = asset_id
         self.asset_path = os.path.join(self.assets_path, self.asset_id)
+        self.cold_archive_path = os.path.join(
+            self.assets_path, "archives", f"{self.asset_id}.tar.gz"
+        )
 
         if images_path is not None:
             self.images_url = (
@@ -29,6 +84,7 @@ class Asset:
             )
             self.zip_path = f"{self.asset_path}.zip"
             self.dir_path = f"{self.asset_path}/input"
+            self.images_key = None
 
             os.makedirs(self.dir_path, exist_ok=True)
 
@@ -60,7 +116,7 @@ class Asset:
         )
 
         if response.status_code != 200:
-            raise AssetUploadError(response.reason)
+            raise AssetUploadError(response.reason, response.status_code)
 
         return response.json()["url"][0]
 
@@ -75,28 +131,156 @@ class Asset:
                 )
 
                 if response.status_code != 200:
-                    raise AssetUploadError(response.reason)
+                    raise AssetUploadError(response.reason, response.status_code)
 
         return f"files/{self.asset_id}/{target_folder}"
 
+    async def archive(self):
+        archive_path = os.path.join(self.asset_path, self.archive_name)
+        await asyncio.get_event_loop().run_in_executor(
+            None, self.__archive, archive_path, "w"
+        )
+
+        try:
+            return await self.upload_archive()
+        finally:
+            os.remove(os.path.join(self.asset_path, self.archive_name))
+
+    async def upload_archive(self):
+        response = await asyncio.get_event_loop().run_in_executor(
+            None, self.__upload, self.archive_name, self.archive_name, "archives"
+        )
+
+        if response.status_code != 200:
+            raise AssetUploadError(response.reason, response.status_code)
+
+        return response.json()["url"][0]
+
+    async def hydrate(self):
+        await asyncio.get_event_loop().run_in_executor(None, self.__hydrate)
+
+    def compress(self):
+        os.makedirs(os.path.dirname(self.cold_archive_path), exist_ok=True)
+        self.__archive(f"{self.cold_archive_path}.tmp", "w:gz")
+        os.replace(f"{self.cold_archive_path}.tmp", self.cold_archive_path)
+        shutil.rmtree(self.asset_path)
+
     def clear(self):
         shutil.rmtree(self.asset_path)
 
+    async def reset(self):
+        await asyncio.get_event_loop().run_in_executor(None, self.__reset)
+
+    def __reset(self):
+        # Outputs of an earlier submission are removed so every stage runs again, the
+        # input folder is kept for its source marker to skip an unchanged extraction
+        if os.path.exists(self.cold_archive_path):
+            os.remove(self.cold_archive_path)
+
+        for entry in os.scandir(self.asset_path):
+            if entry.name in ("input", self.source_marker):
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
     def __download_images(self):
+        if self.download_cache is not None:
+            self.images_key = self.download_cache.fetch(self.images_url, self.zip_path)
+            return
+
         response = request.urlopen(self.images_url)
         with open(self.zip_path, "wb") as f:
             f.write(response.read())
 
     def __download_pcl(self):
+        if self.download_cache is not None:
+            self.download_cache.fetch(self.pcl_url, self.pcl_path)
+            return
+
         response = request.urlopen(self.pcl_url)
         with open(self.pcl_path, "wb") as f:
             f.write(response.read())
 
     def __unzip(self):
+        # The marker records which download the input folder was extracted from
+        marker_path = os.path.join(self.asset_path, self.source_marker)
+        if self.images_key is not None and os.path.exists(marker_path):
+            with open(marker_path) as f:
+                if f.read() == self.images_key:
+                    os.remove(self.zip_path)
+                    return
+        if os.path.exists(marker_path):
+            os.remove(marker_path)
+
         with zipfile.ZipFile(self.zip_path, "r") as zip_ref:
             zip_ref.extractall(self.dir_path)
         os.remove(self.zip_path)
 
+        if self.images_key is not None:
+            with open(marker_path, "w") as f:
+                f.write(self.images_key)
+
+    def __archive(self, archive_path: str, mode: str):
+        def exclude(info: tarfile.TarInfo):
+            for path in self.archive_excludes:
+                if info.name == path or info.name.startswith(path + "/"):
+                    return None
+            return info
+
+        with tarfile.open(archive_path, mode) as tar:
+            for folder in self.archive_folders:
+                if self.exists(folder):
+                    tar.add(
+                        os.path.join(self.asset_path, folder), arcname=folder, filter=exclude
+                    )
+
+    def __hydrate(self):
+        # Cold scenes compressed on this worker are restored without a download
+        if os.path.exists(self.cold_archive_path):
+            self.__extract(self.cold_archive_path)
+            os.remove(self.cold_archive_path)
+            return
+
+        archive_url = f"{self.storage_root}/files/{self.asset_id}/archives/{self.archive_name}?isDownload=true"
+        archive_path = f"{self.asset_path}.tar"
+
+        try:
+            with request.urlopen(archive_url) as response, open(archive_path, "wb") as f:
+                shutil.copyfileobj(response, f)
+        except Exception as e:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+            raise AssetHydrationError(f"Failed downloading {archive_url}: {e}") from e
+
+        try:
+            self.__extract(archive_path)
+        finally:
+            os.remove(archive_path)
+
+    def __extract(self, archive_path: str):
+        staging_path = f"{self.asset_path}.hydrating"
+
+        try:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            with tarfile.open(archive_path, "r") as tar:
+                for member in tar.getmembers():
+                    if member.name.startswith("/") or ".." in member.name.split("/"):
+                        raise AssetHydrationError(f"Unsafe path {member.name} in archive")
+                tar.extractall(staging_path)
+
+            # Move extracted folders in place, cameras.json marks the asset as ready
+            os.makedirs(self.asset_path, exist_ok=True)
+            for folder in sorted(os.listdir(staging_path), key=lambda f: f == "saga"):
+                target = os.path.join(self.asset_path, folder)
+                if os.path.exists(target):
+                    shutil.rmtree(target)
+                os.replace(os.path.join(staging_path, folder), target)
+
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+
     def __upload(self, source_path: str, target_path: str, subfolder_path: str = None):
         source = os.path.join("assets", self.asset_id, source_path)
 
@@ -104,7 +288,12 @@ class Asset:
         if subfolder_path is not None:
             target += "/" + subfolder_path
 
-        with open(source, "rb") as file:
-            files = {"file": (target_path, file)}
-            data = {"folder": target}
-            return requests.post(f"{self.storage_root}/upload", data=data, files=files)
+        body = MultipartFile({"folder": target}, "file", target_path, source)
+        try:
+            return requests.post(
+                f"{self.storage_root}/upload",
+                data=body,
+                headers={"Content-Type": body.content_type},
+            )
+        finally:
+            body.close()
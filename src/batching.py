@@ -0,0 +1,67 @@
+import asyncio
+
+from typing import Any, Awaitable, Callable, Dict, List
+
+
+class QueryBatch:
+    def __init__(self):
+        self.queries: List[Any] = []
+        self.futures: List[asyncio.Future] = []
+
+
+class QueryBatcher:
+    def __init__(
+        self,
+        handler: Callable[[str, List[Any], Callable[[int, Any], None]], Awaitable[List[Any]]],
+        max_size: int = 8,
+    ):
+        self.handler = handler
+        self.max_size = max(1, max_size)
+
+        self.batches: Dict[str, QueryBatch] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+
+    async def submit(self, asset_id: str, query: Any):
+        # A full batch may still be waiting for its turn, later queries start a new one
+        batch = self.batches.get(asset_id)
+        if batch is None or len(batch.queries) >= self.max_size:
+            batch = QueryBatch()
+            self.batches[asset_id] = batch
+            asyncio.ensure_future(self.__flush(asset_id, batch))
+
+        future = asyncio.get_event_loop().create_future()
+        batch.queries.append(query)
+        batch.futures.append(future)
+
+        return await future
+
+    async def __flush(self, asset_id: str, batch: QueryBatch):
+        # Handlers may answer each query as soon as it is done, the rest are answered
+        # with the results of the whole batch
+        def respond(index: int, result: Any):
+            self.__resolve(batch.futures[index], result)
+
+        # Batches for the same asset run one at a time since they share output paths.
+        # Queries arriving while an earlier batch runs are collected into this one, so
+        # no query waits on a timer
+        lock = self.locks.setdefault(asset_id, asyncio.Lock())
+        async with lock:
+            # Close the batch so later queries start a new one
+            if self.batches.get(asset_id) is batch:
+                del self.batches[asset_id]
+
+            try:
+                results = await self.handler(asset_id, batch.queries, respond)
+            except Exception as e:
+                results = [e] * len(batch.queries)
+
+        for future, result in zip(batch.futures, results):
+            self.__resolve(future, result)
+
+    def __resolve(self, future: asyncio.Future, result: Any):
+        if future.done():
+            return
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import filecmp
+import logging
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from models import PTv3, conda_source
+from pointclouds import PointCloudConverter, s3dis_palette
+
+
+# Files both conversion paths write, relative to the asset
+output_paths = [
+    "data/scene/scene/scene/scene.txt",
+    "data/scene/scene/scene/Annotations/clutter_1.txt",
+    "data/scene/scene/scene_alignmentAngle.txt",
+    "segmentation/ptv3.ply",
+]
+
+
+def gaussian_dtype():
+    fields = ["x", "y", "z", "nx", "ny", "nz", "f_dc_0", "f_dc_1", "f_dc_2"]
+    fields += [f"f_rest_{i}" for i in range(45)]
+    fields += ["opacity", "scale_0", "scale_1", "scale_2"]
+    fields += ["rot_0", "rot_1", "rot_2", "rot_3"]
+    return np.dtype([(field, "<f4") for field in fields])
+
+
+def lidar_dtype():
+    return np.dtype(
+        [
+            ("x", "<f4"),
+            ("y", "<f4"),
+            ("z", "<f4"),
+            ("red", "u1"),
+            ("green", "u1"),
+            ("blue", "u1"),
+        ]
+    )
+
+
+def write_cloud(path: str, dtype: np.dtype, count: int, seed: int = 0):
+    # Synthetic clouds are written in chunks so large ones do not need the memory
+    types = {"<f4": "float", "|u1": "uchar"}
+    header = ["ply", "format binary_little_endian 1.0", f"element vertex {count}"]
+    header += [f"property {types[dtype[name].str]} {name}" for name in dtype.names]
+    header += ["end_header", ""]
+
+    random = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write("\n".join(header).encode("ascii"))
+        for start in range(0, count, 1 << 20):
+            points = np.zeros(min(count - start, 1 << 20), dtype=dtype)
+            for name in dtype.names:
+                if dtype[name].kind == "u":
+                    points[name] = random.integers(0, 256, len(points))
+                else:
+                    points[name] = random.normal(0, 5, len(points))
+            f.write(points.tobytes())
+
+
+def write_labels(path: str, count: int, seed: int = 0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    labels = np.random.default_rng(seed).integers(0, len(s3dis_palette), count)
+    np.save(path, labels.astype(np.int64))
+
+
+def keep_outputs(ptv3: PTv3, reference_path: str):
+    for path in output_paths:
+        target = os.path.join(reference_path, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(os.path.join(ptv3.asset_path, path), target)
+
+
+def compare_outputs(ptv3: PTv3, reference_path: str):
+    # The native path may only replace the scripts if it writes the same bytes
+    return [
+        path
+        for path in output_paths
+        if not filecmp.cmp(
+            os.path.join(ptv3.asset_path, path),
+            os.path.join(reference_path, path),
+            shallow=False,
+        )
+    ]
+
+
+def measure(coroutine):
+    start_time = time.time()
+    asyncio.run(coroutine)
+    return time.time() - start_time
+
+
+def benchmark(ptv3: PTv3, converter: PointCloudConverter):
+    data_path = os.path.join(ptv3.asset_path, "data")
+    segmentation_path = os.path.join(ptv3.asset_path, "segmentation")
+    labels_path = os.path.join(data_path, "result/scene.npy")
+
+    PTv3.converter = converter
+    shutil.rmtree(os.path.join(data_path, "scene"), ignore_errors=True)
+    convert = measure(ptv3.convert())
+    reconstruct = measure(ptv3.reconstruct())
+
+    size = os.path.getsize(os.path.join(data_path, "scene/scene/scene/scene.txt"))
+    if not os.path.exists(os.path.join(segmentation_path, "ptv3.ply")) or not size:
+        raise RuntimeError("Conversion produced no output")
+    if not os.path.exists(labels_path):
+        raise RuntimeError("Labels are missing")
+
+    return convert, reconstruct
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, len(os.sched_getaffinity(0))])
+    parser.add_argument("--chunk-size", type=int, default=1 << 18)
+    parser.add_argument("--type", choices=["gaussian", "lidar"], default="gaussian")
+    parser.add_argument("--subprocess", action="store_true")
+    args = parser.parse_args()
+
+    log_format = "%(asctime)s [%(levelname)s]: (%(name)s) %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_format)
+
+    # The subprocess path needs the pointcept scripts and conda environment
+    subprocess_available = os.path.exists(conda_source) and os.path.exists(
+        "models/pointcept/convert_ply.py"
+    )
+    if args.subprocess and not subprocess_available:
+        logging.warning("Pointcept is not set up, skipping the subprocess path")
+
+    mismatched = False
+    for count in args.points:
+        asset_id = f"benchmark-{args.type}-{count}"
+        ptv3 = PTv3(asset_id=asset_id, asset_type=args.type)
+        input_path = os.path.join(ptv3.asset_path, ptv3.input_path)
+
+        dtype = lidar_dtype() if args.type == "lidar" else gaussian_dtype()
+        write_cloud(input_path, dtype, count)
+        write_labels(os.path.join(ptv3.asset_path, "data/result/scene.npy"), count)
+
+        reference_path = os.path.join(ptv3.asset_path, "reference")
+
+        try:
+            logging.info(f"{count} points, {os.path.getsize(input_path) / 1024 ** 2:.1f}MB")
+
+            # The subprocess path runs first so its outputs can be compared to the native ones
+            if args.subprocess and subprocess_available:
+                convert, reconstruct = benchmark(ptv3, None)
+                keep_outputs(ptv3, reference_path)
+                logging.info(
+                    f"└- subprocess: convert {convert:.2f}s, reconstruct {reconstruct:.2f}s"
+                )
+
+            for workers in args.workers:
+                converter = PointCloudConverter(workers=workers, chunk_size=args.chunk_size)
+                try:
+                    # The first run starts the worker processes, which a runner keeps
+                    benchmark(ptv3, converter)
+                    convert, reconstruct = benchmark(ptv3, converter)
+                finally:
+                    converter.shutdown()
+
+                logging.info(
+                    f"└- native, {workers} workers: convert {convert:.2f}s, "
+                    f"reconstruct {reconstruct:.2f}s"
+                )
+
+                if os.path.exists(reference_path):
+                    differences = compare_outputs(ptv3, reference_path)
+                    if differences:
+                        mismatched = True
+                        logging.error(f"└- Differs from subprocess: {', '.join(differences)}")
+                    else:
+                        logging.info("└- Identical to subprocess")
+
+        finally:
+            shutil.rmtree(ptv3.asset_path, ignore_errors=True)
+
+    if mismatched:
+        sys.exit(1)
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+
+from typing import Dict, List, Set
+
+from assets import Asset
+
+
+class DiskManager:
+    # Artifacts that no later stage or query reads once the given stage has finished
+    stage_intermediates: Dict[str, List[str]] = {
+        "pointcloud": [
+            "input",
+            Asset.source_marker,
+            "distorted",
+            "stereo",
+            "run-colmap-geometric.sh",
+            "run-colmap-photometric.sh",
+        ],
+        "saga": ["sam_masks"],
+    }
+
+    # Files inside released folders that later stages still read
+    stage_keeps: Dict[str, List[str]] = {
+        "pointcloud": ["input/lidar.ply"],
+    }
+
+    def __init__(
+        self,
+        storage_root: str,
+        assets_path: str = "assets",
+        budget: int = 100 * 1024**3,
+        cold_after: float = 24 * 60 * 60,
+    ):
+        self.storage_root = storage_root
+        self.assets_path = assets_path
+        self.archives_path = os.path.join(assets_path, "archives")
+        self.budget = budget
+        self.cold_after = cold_after
+
+        self.pins: Dict[str, int] = {}
+        self.evicting = set()
+        self.accessed: Dict[str, float] = {}
+        self.enforcing = False
+
+    async def pin(self, asset_id: str):
+        while asset_id in self.evicting:
+            await asyncio.sleep(0.5)
+
+        self.pins[asset_id] = self.pins.get(asset_id, 0) + 1
+        self.touch(asset_id)
+
+    def unpin(self, asset_id: str):
+        self.pins[asset_id] -= 1
+        if self.pins[asset_id] <= 0:
+            del self.pins[asset_id]
+
+    def touch(self, asset_id: str):
+        self.accessed[asset_id] = time.time()
+
+    def held(self):
+        trained = [asset_id for asset_id in self.__assets() if self.__trained(asset_id)]
+        return trained + self.__archived()
+
+    def holds(self, asset_id: str):
+        return self.__trained(asset_id) or os.path.exists(
+            os.path.join(self.archives_path, f"{asset_id}.tar.gz")
+        )
+
+    async def release(self, asset_id: str, stage: str):
+        asset_path = os.path.join(self.assets_path, asset_id)
+        paths = [
+            os.path.join(asset_path, path) for path in self.stage_intermediates[stage]
+        ]
+        keep = [os.path.join(asset_path, path) for path in self.stage_keeps.get(stage, [])]
+        await asyncio.get_event_loop().run_in_executor(None, self.__remove, paths, keep)
+
+    async def enforce(self, keep: List[str] = []):
+        if self.enforcing:
+            return
+
+        self.enforcing = True
+        try:
+            await self.__enforce(set(keep))
+        finally:
+            self.enforcing = False
+
+    async def __enforce(self, keep: Set[str]):
+        loop = asyncio.get_event_loop()
+
+        # Compress trained scenes that have not been queried for a while
+        for asset_id in self.__assets():
+            if self.__pinned(asset_id, keep) or not self.__trained(asset_id):
+                continue
+            if time.time() - self.__last_access(asset_id) < self.cold_after:
+                continue
+
+            logging.info(f"Compressing cold asset {asset_id}...")
+            await self.__exclusive(asset_id, self.__asset(asset_id).compress)
+
+        usage = await loop.run_in_executor(None, self.__size, self.assets_path)
+        if usage <= self.budget:
+            return
+
+        # Evict least recently queried assets and archives until under budget
+        candidates = sorted(
+            set(self.__assets()) | set(self.__archived()),
+            key=self.__last_access,
+        )
+        for asset_id in candidates:
+            if usage <= self.budget:
+                break
+            if self.__pinned(asset_id, keep):
+                continue
+
+            freed = await self.__exclusive(asset_id, self.__evict, asset_id)
+            usage -= freed
+            logging.info(f"Evicted asset {asset_id} ({freed / 1024**3:.2f} GiB)")
+
+        if usage > self.budget:
+            logging.warning(
+                f"Assets use {usage / 1024**3:.2f} GiB, over the "
+                f"{self.budget / 1024**3:.2f} GiB budget with all remaining assets pinned"
+            )
+
+    async def __exclusive(self, asset_id: str, func, *args):
+        self.evicting.add(asset_id)
+        try:
+            return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+        finally:
+            self.evicting.discard(asset_id)
+
+    def __evict(self, asset_id: str):
+        asset = self.__asset(asset_id)
+
+        freed = 0
+        for path in [asset.asset_path, asset.cold_archive_path]:
+            freed += self.__size(path)
+        self.__remove([asset.asset_path, asset.cold_archive_path])
+        self.accessed.pop(asset_id, None)
+
+        return freed
+
+    def __asset(self, asset_id: str):
+        return Asset(
+            storage_root=self.storage_root,
+            asset_id=asset_id,
+            images_path=None,
+            pcl_path=None,
+        )
+
+    def __assets(self):
+        if not os.path.isdir(self.assets_path):
+            return []
+        return [
+            entry.name
+            for entry in os.scandir(self.assets_path)
+            if entry.is_dir() and entry.name != "archives" and "." not in entry.name
+        ]
+
+    def __archived(self):
+        if not os.path.isdir(self.archives_path):
+            return []
+        return [
+            entry.name[: -len(".tar.gz")]
+            for entry in os.scandir(self.archives_path)
+            if entry.name.endswith(".tar.gz")
+        ]
+
+    def __pinned(self, asset_id: str, keep: Set[str] = set()):
+        return asset_id in self.pins or asset_id in keep
+
+    def __trained(self, asset_id: str):
+        return os.path.exists(
+            os.path.join(self.assets_path, asset_id, "saga/cameras.json")
+        )
+
+    def __last_access(self, asset_id: str):
+        if asset_id in self.accessed:
+            return self.accessed[asset_id]
+
+        for path in [
+            os.path.join(self.assets_path, asset_id),
+            os.path.join(self.archives_path, f"{asset_id}.tar.gz"),
+        ]:
+            if os.path.exists(path):
+                return os.path.getmtime(path)
+        return 0
+
+    def __remove(self, paths: List[str], keep: List[str] = []):
+        for path in paths:
+            if path in keep:
+                continue
+
+            # Folders holding kept files are emptied around them
+            if os.path.isdir(path) and any(k.startswith(path + os.sep) for k in keep):
+                self.__remove([os.path.join(path, entry) for entry in os.listdir(path)], keep)
+            elif os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def __size(self, path: str):
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+
+        size = 0
+        for root, _, files in os.walk(path):
+            for file in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, file))
+                except OSError:
+                    pass
+        return size
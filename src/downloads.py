@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from typing import Dict, Optional
+from urllib import request
+from urllib.error import HTTPError
+
+
+class DownloadCache:
+    def __init__(self, path: str = "downloads", budget: int = 20 * 1024**3):
+        self.path = path
+        self.budget = budget
+        self.index_path = os.path.join(path, "index.json")
+        self.lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        self.entries: Dict[str, dict] = self.__load()
+
+    def fetch(self, url: str, target_path: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None and not os.path.exists(self.__file(entry)):
+                entry = None
+
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response = request.urlopen(request.Request(url, headers=headers))
+        except HTTPError as e:
+            if e.code != 304 or entry is None:
+                raise
+
+            logging.info(f"└- Using cached download of {url}")
+            self.__copy(self.__file(entry), target_path)
+            self.__touch(url)
+            return entry["key"]
+
+        with response:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            size = response.headers.get("Content-Length")
+
+            # Without a validator the content cannot be revalidated, so it is not kept
+            if not etag and not last_modified:
+                with open(target_path, "wb") as f:
+                    shutil.copyfileobj(response, f)
+                return None
+
+            key = hashlib.sha256(f"{url}:{etag}:{last_modified}:{size}".encode()).hexdigest()
+            entry = {
+                "key": key,
+                "etag": etag,
+                "last_modified": last_modified,
+                "size": None,
+                "accessed": time.time(),
+            }
+
+            temp_path = f"{self.__file(entry)}.{threading.get_ident()}.tmp"
+            try:
+                with open(temp_path, "wb") as f:
+                    shutil.copyfileobj(response, f)
+                entry["size"] = os.path.getsize(temp_path)
+                os.replace(temp_path, self.__file(entry))
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        with self.lock:
+            previous = self.entries.get(url)
+            if previous is not None and previous["key"] != key:
+                self.__remove(previous)
+            self.entries[url] = entry
+            self.__evict(keep=url)
+            self.__save()
+
+        self.__copy(self.__file(entry), target_path)
+        return key
+
+    def size(self):
+        with self.lock:
+            return sum(entry["size"] for entry in self.entries.values())
+
+    def __touch(self, url: str):
+        with self.lock:
+            if url in self.entries:
+                self.entries[url]["accessed"] = time.time()
+                self.__save()
+
+    def __evict(self, keep: str):
+        # Least recently used downloads go first, the one just stored always stays
+        total = sum(entry["size"] for entry in self.entries.values())
+        for url, entry in sorted(self.entries.items(), key=lambda item: item[1]["accessed"]):
+            if total <= self.budget:
+                break
+            if url == keep:
+                continue
+
+            logging.info(f"└- Evicting cached download of {url}")
+            self.__remove(entry)
+            del self.entries[url]
+            total -= entry["size"]
+
+    def __copy(self, source: str, target: str):
+        if os.path.exists(target):
+            os.remove(target)
+
+        # Hard links avoid a second copy of the bytes when the cache shares the disk
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+    def __remove(self, entry: dict):
+        try:
+            os.remove(self.__file(entry))
+        except FileNotFoundError:
+            pass
+
+    def __file(self, entry: dict):
+        return os.path.join(self.path, entry["key"])
+
+    def __load(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def __save(self):
+        with open(f"{self.index_path}.tmp", "w") as f:
+            json.dump(self.entries, f)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
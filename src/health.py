@@ -0,0 +1,61 @@
+import asyncio
+import json
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Tuple
+from urllib import parse
+
+
+class HealthServer:
+    def __init__(
+        self,
+        routes: Dict[str, Callable[[], Tuple[bool, dict]]],
+        host: str = "0.0.0.0",
+        port: int = 8090,
+    ):
+        self.routes = routes
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self):
+        # Checks run on the event loop so they read the worker state between callbacks
+        loop = asyncio.get_event_loop()
+        routes = self.routes
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                route = routes.get(parse.urlparse(self.path).path)
+                if route is None:
+                    self.send_error(404)
+                    return
+
+                async def check():
+                    return route()
+
+                try:
+                    ok, report = asyncio.run_coroutine_threadsafe(check(), loop).result(5)
+                except Exception as e:
+                    ok, report = False, {"error": str(e)}
+
+                body = json.dumps(report).encode()
+                self.send_response(200 if ok else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), HealthHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logging.info(f"Serving health checks on {self.host}:{self.port}")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,177 @@
+import json
+import sqlite3
+import threading
+import time
+
+from typing import List, Optional
+
+
+class JobStore:
+    stages = ["downloaded", "pointcloud", "gaussian", "saga"]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                asset_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                message_id TEXT,
+                status TEXT NOT NULL,
+                stage TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS publications (
+                asset_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                published REAL NOT NULL,
+                PRIMARY KEY (asset_id, name)
+            )
+            """
+        )
+
+    def claim(
+        self,
+        asset_id: str,
+        payload: dict,
+        message_id: Optional[str] = None,
+        resume: bool = False,
+        active: bool = False,
+    ):
+        now = time.time()
+
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                job = self.__get(asset_id)
+
+                if job is not None:
+                    # Retries, recoveries and redeliveries of the claimed message continue
+                    # the job they belong to, any other message is a new submission of the
+                    # asset and starts over
+                    resume = resume or (
+                        message_id is not None and message_id == job["message_id"]
+                    )
+
+                    if job["status"] == "completed" and resume:
+                        self.connection.execute("ROLLBACK")
+                        return "completed"
+
+                    # A job still running on this worker means the delivery is a duplicate
+                    if job["status"] == "running" and active:
+                        self.connection.execute("ROLLBACK")
+                        return "active"
+
+                    if not resume:
+                        self.connection.execute(
+                            "DELETE FROM publications WHERE asset_id = ?", (asset_id,)
+                        )
+
+                self.connection.execute(
+                    """
+                    INSERT INTO jobs
+                        (asset_id, payload, message_id, status, attempts, created, updated)
+                    VALUES (?, ?, ?, 'running', 1, ?, ?)
+                    ON CONFLICT(asset_id) DO UPDATE SET
+                        payload = excluded.payload,
+                        message_id = CASE WHEN ? THEN message_id ELSE excluded.message_id END,
+                        status = 'running',
+                        stage = CASE WHEN ? THEN stage ELSE NULL END,
+                        attempts = CASE WHEN ? AND status != 'dead' THEN attempts + 1 ELSE 1 END,
+                        error = NULL,
+                        updated = excluded.updated
+                    """,
+                    (asset_id, json.dumps(payload), message_id, now, now, resume, resume, resume),
+                )
+                self.connection.execute("COMMIT")
+                return "claimed"
+
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def advance(self, asset_id: str, stage: str):
+        self.__update(asset_id, "stage = ?", stage)
+
+    def complete(self, asset_id: str):
+        self.__update(asset_id, "status = 'completed'")
+
+    def fail(self, asset_id: str, error: str, dead: bool = False):
+        status = "dead" if dead else "failed"
+        self.__update(asset_id, "status = ?, error = ?", status, error)
+
+    def release(self, asset_id: str):
+        # Jobs handed back while draining are claimed again without using an attempt
+        self.__update(asset_id, "status = 'released', attempts = attempts - 1")
+
+    def hand_off(self, asset_id: str):
+        # Jobs put back on the queue are no longer this worker's to recover
+        self.__update(asset_id, "status = 'handed_off'")
+
+    def publish(self, asset_id: str, name: str):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO publications (asset_id, name, published) VALUES (?, ?, ?)",
+                (asset_id, name, time.time()),
+            )
+
+    def published(self, asset_id: str, name: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM publications WHERE asset_id = ? AND name = ?",
+                (asset_id, name),
+            ).fetchone()
+        return row is not None
+
+    def reached(self, asset_id: str, stage: str):
+        job = self.get(asset_id)
+        if job is None or job["stage"] is None:
+            return False
+        return self.stages.index(job["stage"]) >= self.stages.index(stage)
+
+    def get(self, asset_id: str) -> Optional[dict]:
+        with self.lock:
+            job = self.__get(asset_id)
+        return dict(job) if job is not None else None
+
+    def retrying(self) -> List[str]:
+        with self.lock:
+            jobs = self.connection.execute(
+                "SELECT asset_id FROM jobs WHERE status = 'failed'"
+            ).fetchall()
+        return [job["asset_id"] for job in jobs]
+
+    def orphaned(self) -> List[dict]:
+        # Running jobs and jobs not yet put back on the queue, left behind by a previous
+        # run of this worker
+        with self.lock:
+            jobs = self.connection.execute(
+                "SELECT * FROM jobs WHERE status IN ('running', 'released')"
+            ).fetchall()
+        return [dict(job) for job in jobs]
+
+    def __get(self, asset_id: str):
+        return self.connection.execute(
+            "SELECT * FROM jobs WHERE asset_id = ?", (asset_id,)
+        ).fetchone()
+
+    def __update(self, asset_id: str, assignment: str, *values):
+        with self.lock:
+            self.connection.execute(
+                f"UPDATE jobs SET {assignment}, updated = ? WHERE asset_id = ?",
+                (*values, time.time(), asset_id),
+            )
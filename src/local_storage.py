@@ -0,0 +1,103 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+
+from email.parser import BytesParser
+from email.policy import HTTP
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+
+class LocalStorageHandler(BaseHTTPRequestHandler):
+    root = "storage"
+
+    def do_GET(self):
+        path = self.__resolve(parse.urlparse(self.path).path)
+        if path is None or not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        stat = os.stat(path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(stat.st_size))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        self.end_headers()
+
+        with open(path, "rb") as file:
+            shutil.copyfileobj(file, self.wfile)
+
+    def do_POST(self):
+        if parse.urlparse(self.path).path != "/upload":
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        content_type = self.headers.get("Content-Type", "")
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + self.rfile.read(length)
+        )
+
+        folder, filename, content = None, None, None
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "folder":
+                folder = part.get_payload(decode=True).decode()
+            elif name == "file":
+                filename = part.get_filename()
+                content = part.get_payload(decode=True)
+
+        path = self.__resolve(f"/files/{folder}/{filename}")
+        if folder is None or filename is None or path is None:
+            self.send_error(400)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(content)
+
+        body = json.dumps({"url": [f"files/{folder}/{filename}"]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __resolve(self, url_path: str):
+        url_path = parse.unquote(url_path)
+        if not url_path.startswith("/files/"):
+            return None
+
+        root = os.path.abspath(self.root)
+        path = os.path.abspath(os.path.join(root, url_path[len("/files/") :]))
+        if not path.startswith(root + os.sep):
+            return None
+        return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default="storage")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    log_format = "%(asctime)s [%(levelname)s]: (%(name)s) %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_format)
+
+    LocalStorageHandler.root = args.root
+    server = ThreadingHTTPServer((args.host, args.port), LocalStorageHandler)
+
+    logging.info(f"Serving local storage from {args.root} on {args.host}:{args.port}")
+    server.serve_forever()
@@ -3,25 +3,35 @@ import json
 import logging
 import os
 import requests
+import signal
+import socket
 import time
 
 from dotenv import load_dotenv
-from pathlib import Path
+from urllib.error import HTTPError, URLError
 
-from aio_pika import connect_robust
-from aio_pika.abc import AbstractIncomingMessage
+from aio_pika import DeliveryMode, ExchangeType, Message, connect_robust
+from aio_pika.abc import AbstractExchange, AbstractIncomingMessage
 
-from assets import Asset, AssetUploadError
+from assets import Asset, AssetHydrationError, AssetUploadError
+from batching import QueryBatcher
+from disk import DiskManager
+from downloads import DownloadCache
+from health import HealthServer
+from jobs import JobStore
 from models import (
     ColmapError,
     GaussianSplatting,
     GaussianSplattingError,
+    Model,
     PTv3,
     PTv3ConvertError,
     PTv3InferenceError,
     PTv3PreprocessError,
     PTv3ReconstructionError,
+    PTv3Server,
     Saga,
+    conda_source,
     SagaExtractFeaturesError,
     SagaExtractMasksError,
     SagaRenderError,
@@ -29,16 +39,99 @@ from models import (
     SagaTrainFeaturesError,
     SagaTrainSceneError,
 )
+from pointclouds import PointCloudConverter
+from preflight import Preflight, PreflightError
+from profiler import FakeGpuBackend, NvmlBackend, Profiler
+from results import SegmentationCache
+from retries import RetryPolicy, RetryQueue
+from routing import AssetDirectory, WorkerAnnouncement
+from scenes import CameraNotFoundError, SceneCache
+from scheduler import GpuScheduler
+from transfers import TransferError, TransferQueue
+from utils import gpu_count
 
 
 class PatchError(Exception):
     pass
 
 
+class StageError(Exception):
+    pass
+
+
+def failure_reason(e: Exception, limit: int = 2000):
+    reason = str(e) or type(e).__name__
+    if e.__cause__ is not None and str(e.__cause__):
+        reason += f": {e.__cause__}"
+    return reason[-limit:]
+
+
+def stage_error(message: str, cause: Exception):
+    # Errors returned rather than raised keep their cause for the retry decision
+    error = StageError(message)
+    error.__cause__ = cause
+    return error
+
+
+def http_status(e: BaseException):
+    if isinstance(e, HTTPError):
+        return e.code
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code
+    if isinstance(e, (AssetUploadError, PatchError)) and len(e.args) > 1:
+        return e.args[1]
+    return None
+
+
+def is_transient(e: BaseException):
+    # Connection errors, timeouts and server errors may clear up when retried
+    status = http_status(e)
+    if status is not None:
+        return status >= 500 or status in retryable_statuses
+    if isinstance(e, AssetHydrationError):
+        return e.__cause__ is not None and is_transient(e.__cause__)
+    return isinstance(
+        e,
+        (URLError, requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError),
+    )
+
+
+def is_permanent(e: BaseException):
+    # Client errors and unknown images fail the same way however often they are retried
+    while e is not None:
+        if isinstance(e, CameraNotFoundError):
+            return True
+
+        status = http_status(e)
+        if status is not None and 400 <= status < 500 and status not in retryable_statuses:
+            return True
+
+        e = e.__cause__
+    return False
+
+
+async def retry_transfer(func, *args):
+    return await transfer_policy.run(func, *args, retry_if=is_transient)
+
+
+async def patch_asset(kind: str, asset_id: str, url: str):
+    response = await asyncio.get_event_loop().run_in_executor(
+        None,
+        lambda: requests.patch(
+            f"{api_root}/assets/{kind}/{asset_id}",
+            headers={"Content-Type": "application/json"},
+            data=json.dumps({"url": url}),
+        ),
+    )
+
+    if response.status_code != 200:
+        raise PatchError(response.reason, response.status_code)
+
+
 async def process_task(message: AbstractIncomingMessage):
     logging.info("Received process message:")
 
-    # ==== Parse message and create model instances
+    # ==== Parse message and claim the job
 
     data = json.loads(message.body.decode())
 
@@ -48,7 +141,45 @@ async def process_task(message: AbstractIncomingMessage):
     if "point_cloud_url" in data:
         logging.info(f"└- Point cloud URL: {data['point_cloud_url']}")
 
+    asset_id = data["asset_id"]
+
+    # The consumer is paused when all job slots are taken or the worker drains, but a
+    # message may still have been delivered before the pause took effect
+    if draining or len(running_jobs) >= max_jobs:
+        await message.nack()
+        return
+
+    # Messages this worker republished for a retry or a recovery continue their job,
+    # any other message is a new submission. The redelivered flag is not used since
+    # new submissions are also redelivered after a nack or a cancelled consumer
+    headers = message.headers or {}
+    status = job_store.claim(
+        asset_id,
+        data,
+        message_id=message.message_id,
+        resume="x-attempts" in headers or "x-resume" in headers,
+        active=asset_id in running_jobs,
+    )
+    if status != "claimed":
+        logging.info(f"[SKIPPED] Job for asset {asset_id} is already {status}")
+        await message.ack()
+        return
+
+    # The consumer is paused before acking so prefetched messages are not handed
+    # back after this one has been taken
+    running_jobs[asset_id] = asyncio.ensure_future(run_task(data))
+    if len(running_jobs) >= max_jobs:
+        await pause_processing()
+
+    # The job is tracked in the job store from here on, so the message is not held
+    # for the whole pipeline
+    await message.ack()
+
+
+async def run_task(data: dict):
     asset_type = data["type"]
+    await disk_manager.pin(data["asset_id"])
+
     asset = Asset(
         storage_root=storage_root,
         asset_id=data["asset_id"],
@@ -56,38 +187,252 @@ async def process_task(message: AbstractIncomingMessage):
         pcl_path=(None if asset_type != "lidar" else data["point_cloud_url"]),
     )
 
-    ptv3 = PTv3(asset_id=asset.asset_id, asset_type=asset_type)
+    ptv3 = PTv3(asset_id=asset.asset_id, asset_type=asset_type, client=ptv3_client)
     saga = Saga(asset_id=asset.asset_id, asset_type=asset_type)
     gaussian_splatting = GaussianSplatting(
         asset_id=asset.asset_id, asset_type=asset_type
     )
 
     try:
+        # A new submission starts over, keeping only the extracted input
+        if job_store.get(asset.asset_id)["stage"] is None:
+            await asset.reset()
+
+        # Stages are only skipped while their results are still on disk, since the
+        # asset may have been evicted while the job waited for a retry
+        pointcloud_done = job_store.reached(
+            asset.asset_id, "pointcloud"
+        ) and asset.exists("sparse/0/pointcloud.ply")
+
         # Download and unzip raw data from user
-        await download_asset(asset)
-        await unzip_asset(asset)
+        if pointcloud_done or (
+            job_store.reached(asset.asset_id, "downloaded") and asset.exists("input")
+        ):
+            logging.info(f"[SKIPPED] Downloading asset {asset.asset_id}")
+        else:
+            await download_asset(asset)
+            await unzip_asset(asset)
+            job_store.advance(asset.asset_id, "downloaded")
 
-        # Generate point cloud for asset
-        await generate_pointcloud(asset, gaussian_splatting)
+        # Generate point cloud for asset, uploading it while the next stages run
+        if pointcloud_done:
+            logging.info(f"[SKIPPED] Generating pointcloud for asset {asset.asset_id}")
+        else:
+            await generate_pointcloud(asset, gaussian_splatting)
+            await disk_manager.release(asset.asset_id, "pointcloud")
+            job_store.advance(asset.asset_id, "pointcloud")
+
+        enqueue_publication(asset, "pointcloud", upload_pointcloud)
 
         # Generate gaussian splatting for asset
-        await generate_gaussian(asset, gaussian_splatting)
+        if job_store.reached(asset.asset_id, "gaussian") and asset.exists(
+            "output/point_cloud/iteration_7000/scene_point_cloud.ply"
+        ):
+            logging.info(f"[SKIPPED] Generating gaussian for asset {asset.asset_id}")
+        else:
+            await generate_gaussian(asset, gaussian_splatting)
+            job_store.advance(asset.asset_id, "gaussian")
+
+        enqueue_publication(asset, "gaussian", upload_gaussian)
 
         # Process PTv3
-        # await process_ptv3(asset, ptv3)
+        if ptv3_enabled:
+            await process_ptv3(asset, ptv3)
 
         # Process SAGA
-        await process_saga(asset, saga)
+        if job_store.reached(asset.asset_id, "saga") and asset.exists("saga/cameras.json"):
+            logging.info(f"[SKIPPED] Processing SAGA for asset {asset.asset_id}")
+        else:
+            await process_saga(asset, saga)
+            await disk_manager.release(asset.asset_id, "saga")
+            job_store.advance(asset.asset_id, "saga")
 
-        await message.ack()
+        enqueue_publication(asset, "saga", upload_saga)
 
-    except:
-        logging.error("")
-        await message.nack()
+        # The job only completes once every result has been uploaded
+        await transfer_queue.drain(asset.asset_id)
+
+        job_store.complete(asset.asset_id)
+
+    except Exception as e:
+        # Jobs stopped by a drain are put back on the queue before waiting on uploads,
+        # which may outlast the drain. Another worker starts them over from the download
+        if draining:
+            logging.info(f"Handing back job for asset {asset.asset_id}")
+            job_store.release(asset.asset_id)
+            if await requeue_task(data):
+                job_store.hand_off(asset.asset_id)
+
+        # Uploads already queued are let finish so a retry does not repeat them
+        try:
+            await transfer_queue.drain(asset.asset_id)
+        except TransferError:
+            pass
+
+        if draining:
+            return
+
+        reason = failure_reason(e)
+        job = job_store.get(asset.asset_id)
+        dead = not await retry_message(
+            process_retries,
+            json.dumps(data).encode(),
+            job["attempts"],
+            reason,
+            permanent=is_permanent(e),
+        )
+        job_store.fail(asset.asset_id, reason, dead=dead)
+
+    finally:
+        disk_manager.unpin(asset.asset_id)
+
+        if profiler is not None:
+            profiler.save(asset.asset_id)
+        del running_jobs[asset.asset_id]
+
+        if len(running_jobs) < max_jobs:
+            await resume_processing()
+
+        await check_disk_budget()
+
+
+def enqueue_publication(asset: Asset, name: str, upload):
+    if job_store.published(asset.asset_id, name):
+        logging.info(f"[SKIPPED] Uploading {name} for asset {asset.asset_id}")
+        return
+
+    transfer_queue.enqueue(asset.asset_id, name, publish, asset, name, upload)
+
+
+async def publish(asset: Asset, name: str, upload):
+    logging.info(f"Uploading {name} for asset {asset.asset_id}...")
+    start_time = time.time()
+
+    try:
+        await upload(asset)
+
+    except AssetUploadError as e:
+        logging.error(f"└- Failed uploading {name}:")
+        logging.error(e.args[0])
+        raise StageError(f"Failed uploading {name}") from e
+
+    except PatchError as e:
+        logging.error(f"└- Failed patching {name}:")
+        logging.error(e.args[0])
+        raise StageError(f"Failed patching {name}") from e
+
+    except Exception as e:
+        logging.error(f"└- Unknown error when uploading {name}:")
+        logging.error(str(e))
+        raise StageError(f"Unknown error when uploading {name}") from e
+
+    job_store.publish(asset.asset_id, name)
+
+    duration = time.time() - start_time
+    logging.info(f"└- {name.capitalize()} uploaded successfully in {duration:.2f} seconds")
+
+
+async def upload_pointcloud(asset: Asset):
+    url = await retry_transfer(asset.upload, "sparse/0/pointcloud.ply", "pointcloud.ply")
+    await retry_transfer(patch_asset, "pointcloud", asset.asset_id, url)
+
+
+async def upload_gaussian(asset: Asset):
+    url = await retry_transfer(
+        asset.upload,
+        "output/point_cloud/iteration_7000/scene_point_cloud.ply",
+        "3dgs.ply",
+    )
+    await retry_transfer(patch_asset, "gaussian", asset.asset_id, url)
+
+
+async def upload_saga(asset: Asset):
+    # The scene is archived before the patch makes the asset queryable, so any worker
+    # receiving its queries can hydrate it
+    if not job_store.published(asset.asset_id, "archive"):
+        await upload_archive(asset)
+        job_store.publish(asset.asset_id, "archive")
+
+    url = await retry_transfer(asset.upload_folder, "images", "saga")
+    await retry_transfer(patch_asset, "saga", asset.asset_id, "/" + url)
+
+
+async def upload_archive(asset: Asset):
+    # Archive trained scene so other workers can serve its queries
+    await retry_transfer(asset.archive)
+
+
+async def retry_message(
+    retries: RetryQueue,
+    body: bytes,
+    attempt: int,
+    reason: str,
+    headers: dict = None,
+    permanent: bool = False,
+):
+    try:
+        return await retries.retry(body, attempt, reason, headers, permanent)
+
+    except Exception as e:
+        # Without the retry queues the message would be lost, so fall back to the
+        # original queue
+        logging.error(f"Failed scheduling retry:")
+        logging.error(str(e))
+        await retries.channel.default_exchange.publish(
+            Message(body, headers=headers, delivery_mode=DeliveryMode.PERSISTENT),
+            routing_key=retries.queue_name,
+        )
+        return True
+
+
+async def requeue_task(data: dict):
+    try:
+        await process_channel.default_exchange.publish(
+            Message(
+                json.dumps(data).encode(),
+                headers={"x-resume": True},
+                delivery_mode=DeliveryMode.PERSISTENT,
+            ),
+            routing_key=os.getenv("RABBITMQ_QUEUE_PROCESS"),
+        )
+        return True
+
+    except Exception as e:
+        logging.error(f"Failed requeueing job for asset {data['asset_id']}:")
+        logging.error(str(e))
+        return False
+
+
+async def pause_processing():
+    global process_consumer
+
+    if process_consumer is not None:
+        await process_queue.cancel(process_consumer)
+        process_consumer = None
+
+
+async def resume_processing():
+    global process_consumer
+
+    if process_consumer is None and process_queue is not None and not draining:
+        process_consumer = await process_queue.consume(process_task)
+
+
+async def recover_jobs():
+    # Jobs acked by a previous run of this worker that were still running or not yet
+    # handed back are put back on the queue once. Jobs that fail to publish stay
+    # recoverable for the next run
+    for job in job_store.orphaned():
+        logging.info(f"Recovering job for asset {job['asset_id']} at stage {job['stage']}")
+        if await requeue_task(json.loads(job["payload"])):
+            job_store.hand_off(job["asset_id"])
 
 
 async def process_query(message: AbstractIncomingMessage):
+    global active_queries
+
     logging.info("Received SAGA message:")
+    start_time = time.time()
 
     # ==== Parse message and create model instances
 
@@ -99,35 +444,168 @@ async def process_query(message: AbstractIncomingMessage):
     logging.info(f"└- X coordinate: {data['x']}")
     logging.info(f"└- Y coordinate: {data['y']}")
 
-    if not Path("assets", data['asset_id']).exists():
-        await message.nack()
+    if await route_query(message, data["asset_id"]):
         return
 
+    query = {
+        "segment_id": data["unique_identifier"],
+        "image_name": data["url"].split("/")[-1].split(".")[0],
+        "x": data["x"],
+        "y": data["y"],
+    }
+
+    active_queries += 1
+    try:
+        # Queries for the same asset run one batch at a time, sharing identical prompts
+        await query_batcher.submit(data["asset_id"], query)
+
+        gpu_scheduler.record_latency(time.time() - start_time)
+        report = gpu_scheduler.report()
+        logging.info(
+            f"Query {query['segment_id']} served in {time.time() - start_time:.2f} seconds "
+            f"(p50 {report['p50']:.2f}s, p95 {report['p95']:.2f}s over {report['count']} queries)"
+        )
+
+    except Exception as e:
+        attempt = int((message.headers or {}).get("x-attempts", 0)) + 1
+        await retry_message(
+            query_retries,
+            message.body,
+            attempt,
+            failure_reason(e),
+            message.headers,
+            permanent=is_permanent(e),
+        )
+
+    finally:
+        active_queries -= 1
+
+    await message.ack()
+
+
+async def route_query(message: AbstractIncomingMessage, asset_id: str):
+    if not routing_enabled or disk_manager.holds(asset_id):
+        return False
+
+    # Forwarded queries are served wherever they land, including ones that expired
+    # in a worker queue and fell back to the shared queue
+    headers = message.headers or {}
+    if "x-forwarded-by" in headers:
+        return False
+
+    owner = asset_directory.owner(asset_id)
+    if owner is None or owner == worker_id:
+        return False
+
+    logging.info(f"└- Forwarding query to worker {owner}")
+
+    try:
+        await query_channel.default_exchange.publish(
+            Message(
+                message.body,
+                headers={**headers, "x-forwarded-by": worker_id},
+                content_type=message.content_type,
+                delivery_mode=DeliveryMode.PERSISTENT,
+            ),
+            routing_key=worker_queue_name(owner),
+        )
+        await message.ack()
+
+    except Exception as e:
+        logging.error(f"└- Failed forwarding query, processing locally:")
+        logging.error(str(e))
+        return False
+
+    return True
+
+
+async def process_announcement(message: AbstractIncomingMessage):
+    announcement = WorkerAnnouncement.decode(message.body)
+    if announcement.worker_id != worker_id:
+        asset_directory.update(announcement)
+
+
+async def announce_assets(exchange: AbstractExchange, interval: float):
+    while True:
+        try:
+            assets = await asyncio.get_event_loop().run_in_executor(
+                None, disk_manager.held
+            )
+            announcement = WorkerAnnouncement(
+                worker_id,
+                assets,
+                time.time(),
+                status=worker_status(),
+                capacity=worker_capacity(),
+            )
+            await exchange.publish(Message(announcement.encode()), routing_key="")
+
+        except Exception as e:
+            logging.error(f"Failed announcing assets:")
+            logging.error(str(e))
+
+        await asyncio.sleep(interval)
+
+
+def worker_capacity():
+    return {
+        "jobs": len(running_jobs),
+        "max_jobs": max_jobs,
+        "free_jobs": 0 if draining else max(0, max_jobs - len(running_jobs)),
+        "queries": active_queries,
+        "transfers": transfer_queue.size(),
+        "gpus": gpus,
+    }
+
+
+def worker_status():
+    if draining:
+        return "draining"
+    return "ready" if ready else "starting"
+
+
+def health():
+    connected = connection is not None and not connection.is_closed
+    report = {
+        "worker_id": worker_id,
+        "status": worker_status(),
+        "connected": connected,
+        "capacity": worker_capacity(),
+        "queries": gpu_scheduler.report(),
+    }
+    return connected, report
+
+
+def readiness():
+    connected, report = health()
+    if preflight is not None:
+        report["preflight"] = preflight.report()
+    return connected and worker_status() == "ready", report
+
+
+def worker_queue_name(worker: str):
+    return f"{os.getenv('RABBITMQ_QUEUE_SAGA')}.{worker}"
+
+
+async def process_queries(asset_id: str, queries: list, respond):
     asset = Asset(
         storage_root=storage_root,
-        asset_id=data["asset_id"],
+        asset_id=asset_id,
         images_path=None,
         pcl_path=None,
     )
 
     saga = Saga(asset_id=asset.asset_id, asset_type="lidar")
 
-    segment_id = data["unique_identifier"]
-    image_url = data["url"]
-    x = data["x"]
-    y = data["y"]
-
-    image_name = image_url.split("/")[-1].split(".")[0]
-
+    await disk_manager.pin(asset.asset_id)
     try:
-        # Segment SAGA
-        await segment_saga(asset, saga, segment_id, image_name, x, y)
+        if not asset.exists("saga/cameras.json"):
+            await hydrate_asset(asset)
 
-        await message.ack()
+        return await segment_saga(asset, saga, queries, respond)
 
-    except:
-        logging.error("")
-        await message.nack()
+    finally:
+        disk_manager.unpin(asset.asset_id)
 
 
 async def download_asset(asset: Asset):
@@ -135,12 +613,12 @@ async def download_asset(asset: Asset):
     start_time = time.time()
 
     try:
-        await asset.download()
+        await retry_transfer(asset.download)
 
     except Exception as e:
         logging.error(f"└- Error downloading asset:")
         logging.error(str(e))
-        raise Exception()
+        raise StageError("Error downloading asset") from e
 
     duration = time.time() - start_time
     logging.info(f"└- Asset downloaded successfully in {duration:.2f} seconds")
@@ -156,107 +634,84 @@ async def unzip_asset(asset: Asset):
     except Exception as e:
         logging.error(f"└- Error extracting asset:")
         logging.error(str(e))
-        raise Exception()
+        raise StageError("Error extracting asset") from e
 
     duration = time.time() - start_time
     logging.info(f"└- Asset extracted successfully in {duration:.2f} seconds")
 
 
-async def generate_pointcloud(asset: Asset, gaussian_splatting: GaussianSplatting):
-    if asset.exists("sparse/0/pointcloud.ply"):
-        logging.info(f"[SKIPPED] Generating pointcloud for asset {asset.asset_id}")
-        return
+async def hydrate_asset(asset: Asset):
+    logging.info(f"Hydrating asset {asset.asset_id}...")
+    start_time = time.time()
 
+    try:
+        await retry_transfer(asset.hydrate)
+
+    except AssetHydrationError as e:
+        logging.error(f"└- Failed hydrating asset:")
+        logging.error(e.args[0])
+        raise StageError("Failed hydrating asset") from e
+
+    except Exception as e:
+        logging.error(f"└- Unknown error when hydrating asset:")
+        logging.error(str(e))
+        raise StageError("Unknown error when hydrating asset") from e
+
+    duration = time.time() - start_time
+    logging.info(f"└- Asset hydrated successfully in {duration:.2f} seconds")
+
+
+async def generate_pointcloud(asset: Asset, gaussian_splatting: GaussianSplatting):
     logging.info(f"Generating pointcloud for asset {asset.asset_id}...")
     start_time = time.time()
 
     try:
-        await gaussian_splatting.generate_pointcloud()
+        # A pointcloud left by an earlier attempt does not need to be generated again
+        if asset.exists("sparse/0/pointcloud.ply"):
+            logging.info(f"└- [SKIPPED] Pointcloud already generated")
+        else:
+            await gaussian_splatting.generate_pointcloud()
 
         if not asset.exists("sparse/0/pointcloud.ply"):
             raise ColmapError("pointcloud.ply not found")
 
-        colmap_url = await asset.upload("sparse/0/pointcloud.ply", "pointcloud.ply")
-        response = requests.patch(
-            f"{api_root}/assets/pointcloud/{asset.asset_id}",
-            headers={"Content-Type": "application/json"},
-            data=json.dumps({"url": colmap_url}),
-        )
-
-        if response.status_code != 200:
-            raise PatchError(response.reason)
-
     except ColmapError as e:
         logging.error(f"└- Failed generating pointcloud:")
         logging.error(e.args[0])
-        raise Exception()
-
-    except AssetUploadError as e:
-        logging.error(f"└- Failed uploading pointcloud:")
-        logging.error(e.args[0])
-        raise Exception()
-
-    except PatchError as e:
-        logging.error(f"└- Failed patching pointcloud:")
-        logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed generating pointcloud") from e
 
     except Exception as e:
         logging.error(f"└- Unknown error when generating pointcloud:")
         logging.error(str(e))
-        raise Exception()
+        raise StageError("Unknown error when generating pointcloud") from e
 
     duration = time.time() - start_time
     logging.info(f"└- Pointcloud generated successfully in {duration:.2f} seconds")
 
 
 async def generate_gaussian(asset: Asset, gaussian_splatting: GaussianSplatting):
-    if asset.exists("output/point_cloud/iteration_7000/scene_point_cloud.ply"):
-        logging.info(f"[SKIPPED] Generating gaussian for asset {asset.asset_id}")
-        return
-
     logging.info(f"Generating gaussian for asset {asset.asset_id}...")
     start_time = time.time()
 
     try:
-        await gaussian_splatting.generate_gaussian()
+        # A gaussian left by an earlier attempt does not need to be generated again
+        if asset.exists("output/point_cloud/iteration_7000/scene_point_cloud.ply"):
+            logging.info(f"└- [SKIPPED] Gaussian already generated")
+        else:
+            await gaussian_splatting.generate_gaussian()
 
         if not asset.exists("output/point_cloud/iteration_7000/scene_point_cloud.ply"):
             raise GaussianSplattingError("scene_point_cloud.ply not found")
 
-        gaussian_url = await asset.upload(
-            "output/point_cloud/iteration_7000/scene_point_cloud.ply",
-            "3dgs.ply",
-        )
-
-        response = requests.patch(
-            f"{api_root}/assets/gaussian/{asset.asset_id}",
-            headers={"Content-Type": "application/json"},
-            data=json.dumps({"url": gaussian_url}),
-        )
-
-        if response.status_code != 200:
-            raise PatchError(response.reason)
-
     except GaussianSplattingError as e:
         logging.error(f"└- Failed generating gaussian:")
         logging.error(e.args[0])
-        raise Exception
-
-    except AssetUploadError as e:
-        logging.error(f"└- Failed uploading gaussian:")
-        logging.error(e.args[0])
-        raise Exception()
-
-    except PatchError as e:
-        logging.error(f"└- Failed patching gaussian:")
-        logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed generating gaussian") from e
 
     except Exception as e:
         logging.error(f"└- Unknown error when generating gaussian:")
         logging.error(str(e))
-        raise Exception()
+        raise StageError("Unknown error when generating gaussian") from e
 
     duration = time.time() - start_time
     logging.info(f"└- Gaussian generated successfully in {duration:.2f} seconds")
@@ -316,50 +771,43 @@ async def process_ptv3(asset: Asset, ptv3: PTv3):
         logging.info(f"└--- PTv3 reconstructed successfully in {duration:.2f} seconds")
 
         # Upload and patch result
-        ptv3_url = await asset.upload("segmentation/ptv3.ply", "ptv3.ply")
-        response = requests.patch(
-            f"{api_root}/assets/ptv3/{asset.asset_id}",
-            headers={"Content-Type": "application/json"},
-            data=json.dumps({"url": ptv3_url}),
-        )
-
-        if response.status_code != 200:
-            raise PatchError(response.reason)
+        ptv3_url = await retry_transfer(asset.upload, "segmentation/ptv3.ply", "ptv3.ply")
+        await retry_transfer(patch_asset, "ptv3", asset.asset_id, ptv3_url)
 
     except PTv3ConvertError as e:
         logging.error(f"└- Failed converting PTv3:")
         logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed converting PTv3") from e
 
     except PTv3PreprocessError as e:
         logging.error(f"└- Failed preprocessing PTv3:")
         logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed preprocessing PTv3") from e
 
     except PTv3InferenceError as e:
         logging.error(f"└- Failed inferring PTv3:")
         logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed inferring PTv3") from e
 
     except PTv3ReconstructionError as e:
         logging.error(f"└- Failed reconstructing PTv3:")
         logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed reconstructing PTv3") from e
 
     except AssetUploadError as e:
         logging.error(f"└- Failed uploading PTv3:")
         logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed uploading PTv3") from e
 
     except PatchError as e:
         logging.error(f"└- Failed patching PTv3:")
         logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed patching PTv3") from e
 
     except Exception as e:
         logging.error(f"└- Unknown error when processing PTv3:")
         logging.error(str(e))
-        raise Exception()
+        raise StageError("Unknown error when processing PTv3") from e
 
     duration = time.time() - start_start_time
     logging.info(f"└- PTv3 processed successfully in {duration:.2f} seconds")
@@ -400,6 +848,9 @@ async def process_saga(asset: Asset, saga: Saga):
         if not asset.exists("saga"):
             raise SagaTrainSceneError("saga/ not found")
 
+        scene_cache.invalidate(asset.asset_id)
+        segmentation_cache.clear(asset.asset_path)
+
         duration = time.time() - start_time
         logging.info(f"└--- Scene trained successfully in {duration:.2f} seconds")
 
@@ -411,124 +862,315 @@ async def process_saga(asset: Asset, saga: Saga):
         duration = time.time() - start_time
         logging.info(f"└--- Features trained successfully in {duration:.2f} seconds")
 
-        # Upload result
-        folder_url = await asset.upload_folder("images", "saga")
-        response = requests.patch(
-            f"{api_root}/assets/saga/{asset.asset_id}",
-            headers={"Content-Type": "application/json"},
-            data=json.dumps({"url": "/" + folder_url}),
-        )
-
-        if response.status_code != 200:
-            raise PatchError(response.reason)
-
     except SagaExtractFeaturesError as e:
         logging.error(f"└- Failed extracting features:")
         logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed extracting features") from e
 
     except SagaExtractMasksError as e:
         logging.error(f"└- Failed extracting masks:")
         logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed extracting masks") from e
 
     except SagaTrainSceneError as e:
         logging.error(f"└- Failed training scene:")
         logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed training scene") from e
 
     except SagaTrainFeaturesError as e:
         logging.error(f"└- Failed training features:")
         logging.error(e.args[0])
-        raise Exception()
-
-    except AssetUploadError as e:
-        logging.error(f"└- Failed uploading SAGA:")
-        logging.error(e.args[0])
-        raise Exception()
+        raise StageError("Failed training features") from e
 
     except Exception as e:
         logging.error(f"└- Unknown error when processing SAGA:")
         logging.error(str(e))
-        raise Exception()
+        raise StageError("Unknown error when processing SAGA") from e
 
     duration = time.time() - start_start_time
     logging.info(f"└- SAGA processed successfully in {duration:.2f} seconds")
 
 
-async def segment_saga(
-    asset: Asset, saga: Saga, segment_id: str, image_name: str, x: int, y: int
-):
-    logging.info(f"Segmenting SAGA for asset {asset.asset_id}...")
+async def segment_saga(asset: Asset, saga: Saga, queries: list, respond):
+    logging.info(f"Segmenting SAGA for asset {asset.asset_id} ({len(queries)} queries)...")
     start_start_time = time.time()
 
     try:
-        if not asset.exists("saga/cameras.json"):
-            raise Exception("saga/cameras.json not found")
+        scene = scene_cache.get(asset.asset_id, asset.asset_path)
 
-        cameras = asset.read_json("saga/cameras.json")
-        for camera in cameras:
-            if camera["img_name"] == image_name:
-                image_index = camera["id"]
-                break
-        else:
-            raise Exception("Image name not found")
+    except Exception as e:
+        logging.error(f"└- Failed loading scene:")
+        logging.error(str(e))
+        return [stage_error("Failed loading scene", e)] * len(queries)
+
+    # Resolve every query to its cache key, keeping one prompt per uncached key
+    keys = []
+    prompts = {}
+    for query in queries:
+        try:
+            image_index = scene.image_index(query["image_name"])
+        except CameraNotFoundError as e:
+            keys.append(e)
+            continue
+
+        key = segmentation_cache.key(scene, image_index, query["x"], query["y"])
+        keys.append(key)
+
+        if key not in prompts and not segmentation_cache.pending(asset.asset_path, key):
+            prompts[key] = (query["segment_id"], image_index, query["x"], query["y"])
+
+    # Each query is answered as soon as its own prompt is rendered
+    renders = {key: asyncio.get_event_loop().create_future() for key in prompts}
+    if prompts:
+        asyncio.ensure_future(render_segmentations(saga, prompts, renders))
+
+    async def render(key: str):
+        return await renders[key]
+
+    async def segment(query: dict, key):
+        try:
+            if isinstance(key, Exception):
+                raise key
+
+            result_path, cached = await segmentation_cache.get_or_compute(
+                asset.asset_path, key, lambda: render(key)
+            )
+
+            if cached:
+                logging.info(f"└- [CACHED] Reusing segmentation {key[:12]}")
+
+            # Upload result
+            await retry_transfer(asset.upload, result_path, f"{query['segment_id']}.ply")
+
+        except CameraNotFoundError as e:
+            logging.error(f"└- Failed finding image for {query['segment_id']}:")
+            logging.error(e.args[0])
+            return stage_error("Failed finding image", e)
+
+        except SagaSegmentError as e:
+            logging.error(f"└- Failed segmenting {query['segment_id']}:")
+            logging.error(e.args[0])
+            return stage_error("Failed segmenting", e)
+
+        except SagaRenderError as e:
+            logging.error(f"└- Failed rendering {query['segment_id']}:")
+            logging.error(e.args[0])
+            return stage_error("Failed rendering", e)
+
+        except AssetUploadError as e:
+            logging.error(f"└- Failed uploading SAGA {query['segment_id']}:")
+            logging.error(e.args[0])
+            return stage_error("Failed uploading SAGA", e)
+
+        except Exception as e:
+            logging.error(f"└- Unknown error when processing SAGA {query['segment_id']}:")
+            logging.error(str(e))
+            return stage_error("Unknown error when processing SAGA", e)
+
+        return query["segment_id"]
+
+    async def answer(index: int, query: dict, key):
+        result = await segment(query, key)
+        respond(index, result)
+        return result
+
+    results = await asyncio.gather(
+        *[answer(index, query, key) for index, (query, key) in enumerate(zip(queries, keys))]
+    )
 
-        # Extract features
-        logging.info(f"└- Segmenting...")
-        start_time = time.time()
-        await saga.segment(segment_id, image_index, 1, x, y)
+    succeeded = len([result for result in results if not isinstance(result, Exception)])
+    duration = time.time() - start_start_time
+    logging.info(
+        f"└- SAGA processed {succeeded}/{len(queries)} queries in {duration:.2f} seconds"
+    )
 
-        if not asset.exists(f"saga/segmentation/{segment_id}"):
-            raise SagaSegmentError(f"saga/segmentation/{segment_id} not found")
+    return results
 
-        duration = time.time() - start_time
-        logging.info(f"└--- Segmented successfully in {duration:.2f} seconds")
 
-        # Render masks
-        logging.info(f"└- Rendering...")
+async def render_segmentations(saga: Saga, prompts: dict, renders: dict):
+    # Render writes to a fixed path, so the prompts of a batch run one after another
+    for index, (key, prompt) in enumerate(prompts.items()):
+        logging.info(f"└- Segmenting and rendering prompt {index + 1}/{len(prompts)}...")
         start_time = time.time()
-        await saga.render(segment_id)
 
-        if not asset.exists(
-            "saga/point_cloud/iteration_7000/segmentation/segmentation_seg_no_mask_point_cloud.ply"
-        ):
-            raise SagaRenderError("segmentation_seg_no_mask_point_cloud.ply not found")
+        try:
+            renders[key].set_result(await saga.segment_prompt(*prompt))
+
+        except Exception as e:
+            renders[key].set_exception(e)
+            continue
 
         duration = time.time() - start_time
-        logging.info(f"└--- Rendered successfully in {duration:.2f} seconds")
+        logging.info(f"└--- Segmented and rendered successfully in {duration:.2f} seconds")
+
+
+async def run_preflight():
+    if preflight is None:
+        return
+
+    logging.info("Running preflight checks...")
+    start_time = time.time()
+
+    try:
+        await preflight.run()
 
-        # Upload result
-        await asset.upload(
-            "saga/point_cloud/iteration_7000/segmentation/segmentation_seg_no_mask_point_cloud.ply",
-            f"{segment_id}.ply",
+    except PreflightError as e:
+        if os.getenv("PREFLIGHT_STRICT", "true").lower() == "true":
+            raise
+        logging.warning(f"└- Continuing despite failed preflight checks: {e}")
+        return
+
+    duration = time.time() - start_time
+    logging.info(f"└- Preflight checks passed in {duration:.2f} seconds")
+
+
+async def start_ptv3_server():
+    global ptv3_client
+
+    # The server keeps a model resident on a GPU, so it only runs with the PTv3 stage
+    address = os.getenv("PTV3_SERVER_ADDRESS")
+    if not ptv3_enabled or not address:
+        return None
+
+    logging.info(f"Starting PTv3 server on {address}...")
+    start_time = time.time()
+
+    server = PTv3Server(
+        address=address,
+        authkey=os.getenv("PTV3_SERVER_AUTHKEY", "segment3d").encode(),
+        stub=os.getenv("PTV3_SERVER_STUB", "false").lower() == "true",
+    )
+
+    try:
+        ptv3_client = await asyncio.get_event_loop().run_in_executor(
+            None, server.start
         )
 
-    except SagaSegmentError as e:
-        logging.error(f"└- Failed segmenting:")
+    except PTv3InferenceError as e:
+        logging.error(f"└- Failed starting PTv3 server, falling back to subprocess:")
         logging.error(e.args[0])
-        raise Exception()
+        return None
 
-    except SagaRenderError as e:
-        logging.error(f"└- Failed rendering:")
-        logging.error(e.args[0])
-        raise Exception()
+    duration = time.time() - start_time
+    logging.info(f"└- PTv3 server started successfully in {duration:.2f} seconds")
+    return server
 
-    except AssetUploadError as e:
-        logging.error(f"└- Failed uploading SAGA:")
-        logging.error(e.args[0])
-        raise Exception()
+
+async def check_disk_budget():
+    try:
+        # Jobs waiting for a retry resume from their files, so they are kept as well
+        await disk_manager.enforce(keep=job_store.retrying())
 
     except Exception as e:
-        logging.error(f"└- Unknown error when processing SAGA:")
+        logging.error(f"Failed enforcing disk budget:")
         logging.error(str(e))
-        raise Exception()
 
-    duration = time.time() - start_start_time
-    logging.info(f"└- SAGA processed successfully in {duration:.2f} seconds")
+
+async def enforce_disk_budget(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        await check_disk_budget()
+
+
+async def start_query_routing(channel, query_queue_name: str):
+    interval = float(os.getenv("QUERY_ROUTING_INTERVAL", "30"))
+    forward_ttl = int(float(os.getenv("QUERY_ROUTING_FORWARD_TTL", "60")) * 1000)
+
+    # Every worker announces the scenes it holds on a fanout exchange
+    exchange = await channel.declare_exchange(
+        os.getenv("RABBITMQ_EXCHANGE_ASSETS", "segment3d.assets"), ExchangeType.FANOUT
+    )
+    announcement_queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+    await announcement_queue.bind(exchange)
+    await announcement_queue.consume(process_announcement, no_ack=True)
+
+    # Queries forwarded to this worker fall back to the shared queue if not consumed
+    # in time, so they are not lost when the worker is gone
+    worker_queue = await channel.declare_queue(
+        worker_queue_name(worker_id),
+        durable=True,
+        arguments={
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": query_queue_name,
+            "x-message-ttl": forward_ttl,
+            "x-expires": forward_ttl * 10,
+        },
+    )
+    query_consumers.append((worker_queue, await worker_queue.consume(process_query)))
+
+    asyncio.ensure_future(announce_assets(exchange, interval))
+
+    logging.info(f"Routing queries as worker {worker_id}")
+
+
+async def drain(timeout: float, kill_timeout: float, forced: asyncio.Event):
+    global draining
+
+    draining = True
+    logging.info("Draining worker...")
+
+    # Stop taking new work, messages already prefetched are requeued by RabbitMQ
+    await pause_processing()
+    for queue, consumer_tag in query_consumers:
+        await queue.cancel(consumer_tag)
+    query_consumers.clear()
+
+    deadline = time.time() + timeout
+    if running_jobs or active_queries:
+        logging.info(
+            f"└- Waiting up to {timeout:.0f} seconds for {len(running_jobs)} jobs "
+            f"and {active_queries} queries to finish"
+        )
+    while (running_jobs or active_queries) and time.time() < deadline:
+        if forced.is_set():
+            break
+        await asyncio.sleep(1)
+
+    if running_jobs or active_queries:
+        logging.info(f"└- Stopping {len(running_jobs)} unfinished jobs")
+        await asyncio.get_event_loop().run_in_executor(
+            None, gpu_scheduler.terminate, kill_timeout
+        )
+
+        deadline = time.time() + kill_timeout
+        while (running_jobs or active_queries) and time.time() < deadline:
+            await asyncio.sleep(1)
+
+    logging.info("└- Worker drained")
 
 
 async def main():
+    global connection, ready
+
+    # Fleets stop workers with SIGTERM, which drains them before exiting. A second
+    # signal stops unfinished jobs right away
+    stopping = asyncio.Event()
+    forced = asyncio.Event()
+
+    def stop():
+        (forced if stopping.is_set() else stopping).set()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_event_loop().add_signal_handler(sig, stop)
+
+    health_server = None
+    if os.getenv("HEALTH_PORT"):
+        health_server = HealthServer(
+            routes={"/healthz": health, "/readyz": readiness},
+            host=os.getenv("HEALTH_HOST", "0.0.0.0"),
+            port=int(os.getenv("HEALTH_PORT")),
+        )
+        health_server.start()
+
+    # Broken environments fail here rather than on the first message
+    await run_preflight()
+
+    # Warm servers are started before consuming so the first job does not pay for them
+    ptv3_server = await start_ptv3_server()
+    asyncio.ensure_future(
+        enforce_disk_budget(float(os.getenv("ASSETS_DISK_CHECK_INTERVAL", "600")))
+    )
+
     connection = await connect_robust(
         host=os.getenv("RABBITMQ_HOST"),
         port=int(os.getenv("RABBITMQ_PORT")),
@@ -536,32 +1178,160 @@ async def main():
         password=os.getenv("RABBITMQ_PASSWORD"),
     )
 
-    channel = await connection.channel()
-    await channel.set_qos(prefetch_count=1)
+    global process_channel, process_queue, process_retries, query_channel, query_retries
+
+    process_channel = await connection.channel()
+    await process_channel.set_qos(prefetch_count=1)
 
     process_queue_name = os.getenv("RABBITMQ_QUEUE_PROCESS")
-    process_queue = await channel.declare_queue(process_queue_name, durable=True)
+    process_queue = await process_channel.declare_queue(process_queue_name, durable=True)
+
+    # Queries get their own channel so several can be in flight and batched together
+    query_channel = await connection.channel()
+    await query_channel.set_qos(prefetch_count=query_batcher.max_size)
 
     query_queue_name = os.getenv("RABBITMQ_QUEUE_SAGA")
-    query_queue = await channel.declare_queue(query_queue_name, durable=True)
+    query_queue = await query_channel.declare_queue(query_queue_name, durable=True)
+
+    process_retries = RetryQueue(process_channel, process_queue_name, model_policy)
+    await process_retries.declare()
+
+    query_retries = RetryQueue(query_channel, query_queue_name, query_policy)
+    await query_retries.declare()
+
+    await recover_jobs()
+    await resume_processing()
+    query_consumers.append((query_queue, await query_queue.consume(process_query)))
 
-    await process_queue.consume(process_task)
-    await query_queue.consume(process_query)
+    ready = True
+
+    if routing_enabled:
+        await start_query_routing(query_channel, query_queue_name)
 
     try:
-        logging.info("Listening for messages. Press CTRL+C to exit.")
-        await asyncio.Future()
+        logging.info("Listening for messages. Send SIGTERM or press CTRL+C to drain and exit.")
+        await stopping.wait()
+        await drain(
+            timeout=float(os.getenv("WORKER_DRAIN_TIMEOUT", "3600")),
+            kill_timeout=float(os.getenv("WORKER_KILL_TIMEOUT", "30")),
+            forced=forced,
+        )
     finally:
         await connection.close()
 
+        if health_server is not None:
+            health_server.stop()
+
+        if ptv3_server is not None:
+            ptv3_server.stop()
+
+        if PTv3.converter is not None:
+            PTv3.converter.shutdown()
+
 
 if __name__ == "__main__":
     load_dotenv()
 
     api_root = os.getenv("API_ROOT") + "/api"
     storage_root = os.getenv("STORAGE_ROOT")
+    ptv3_enabled = os.getenv("PTV3", "false").lower() == "true"
+    ptv3_client = None
+    scene_cache = SceneCache(capacity=int(os.getenv("SCENE_CACHE_CAPACITY", "32")))
+    segmentation_cache = SegmentationCache(
+        quantization=int(os.getenv("SEGMENTATION_CACHE_QUANTIZATION", "4"))
+    )
+    disk_manager = DiskManager(
+        storage_root=storage_root,
+        budget=int(float(os.getenv("ASSETS_DISK_BUDGET_GB", "100")) * 1024**3),
+        cold_after=float(os.getenv("ASSETS_COLD_AFTER", "86400")),
+    )
+    if os.getenv("DOWNLOAD_CACHE", "true").lower() == "true":
+        Asset.download_cache = DownloadCache(
+            path=os.getenv("DOWNLOAD_CACHE_PATH", "downloads"),
+            budget=int(float(os.getenv("DOWNLOAD_CACHE_BUDGET_GB", "20")) * 1024**3),
+        )
+    worker_id = os.getenv("WORKER_ID") or socket.gethostname()
+    job_store = JobStore(path=os.getenv("JOB_STORE_PATH", "jobs.db"))
+    max_jobs = int(os.getenv("WORKER_MAX_JOBS", "1"))
+
+    # Transient transfer failures are retried in place, model stages and queries
+    # through retry queues, and permanent failures go to the dead letter queues
+    retryable_statuses = (408, 429)
+    transfer_policy = RetryPolicy(
+        attempts=int(os.getenv("RETRY_TRANSFER_ATTEMPTS", "5")), base_delay=2, max_delay=60
+    )
+    model_policy = RetryPolicy(
+        attempts=int(os.getenv("RETRY_MODEL_ATTEMPTS", "3")), base_delay=60, max_delay=3600
+    )
+    query_policy = RetryPolicy(
+        attempts=int(os.getenv("RETRY_QUERY_ATTEMPTS", "3")), base_delay=5, max_delay=120
+    )
+    process_retries = None
+    query_retries = None
+    transfer_queue = TransferQueue(concurrency=int(os.getenv("TRANSFER_CONCURRENCY", "2")))
+    running_jobs = {}
+    active_queries = 0
+    ready = False
+    draining = False
+    connection = None
+    query_consumers = []
+    process_channel = None
+    process_queue = None
+    process_consumer = None
+    query_channel = None
+    routing_enabled = os.getenv("QUERY_ROUTING", "false").lower() == "true"
+    asset_directory = AssetDirectory(
+        worker_id, ttl=float(os.getenv("QUERY_ROUTING_INTERVAL", "30")) * 3
+    )
+    gpu_scheduler = GpuScheduler(
+        slo=float(os.getenv("QUERY_LATENCY_SLO", "30")),
+        reserved_gpus=int(os.getenv("GPU_RESERVED_FOR_QUERIES", "0")),
+        preemption=os.getenv("GPU_PREEMPTION", "true").lower() == "true",
+    )
+    Model.scheduler = gpu_scheduler
+    if os.getenv("PTV3_NATIVE_CONVERT", "false").lower() == "true":
+        PTv3.converter = PointCloudConverter(
+            workers=int(os.getenv("PTV3_CONVERT_WORKERS", "0")) or None
+        )
+    profiler = None
+    if os.getenv("PROFILE", "false").lower() == "true":
+        profiler = Profiler(
+            output_path=os.getenv("PROFILE_PATH", "profiles"),
+            interval=float(os.getenv("PROFILE_INTERVAL", "1")),
+            gpu_backend=(
+                FakeGpuBackend()
+                if os.getenv("PROFILE_GPU_BACKEND", "nvml") == "fake"
+                else NvmlBackend()
+            ),
+        )
+        Model.profiler = profiler
+    query_batcher = QueryBatcher(
+        handler=process_queries,
+        max_size=int(os.getenv("QUERY_BATCH_SIZE", "8")),
+    )
+
+    preflight = None
+    if os.getenv("PREFLIGHT", "true").lower() == "true":
+        preflight = Preflight(
+            conda_source=conda_source,
+            cache_path=os.getenv("PREFLIGHT_CACHE_PATH", "preflight.json"),
+            warm=os.getenv("PREFLIGHT_WARM", "false").lower() == "true",
+        )
+        preflight.add_environment("saga", commands=["colmap"], modules=["torch"])
+        preflight.add_checkpoint("models/saga/sam.pth")
+        if ptv3_enabled:
+            preflight.add_environment("pointcept", modules=["torch"])
+            preflight.add_checkpoint("models/pointcept/models/ptv3/model/model_best.pth")
+        preflight.add_endpoint(storage_root)
 
     log_format = "%(asctime)s [%(levelname)s]: (%(name)s) %(message)s"
     logging.basicConfig(level=logging.INFO, format=log_format)
 
+    # Counted once since health checks and announcements report it on the event loop
+    try:
+        gpus = gpu_count()
+    except Exception as e:
+        logging.warning(f"Failed counting GPUs, reporting none: {e}")
+        gpus = 0
+
     asyncio.run(main())
@@ -1,9 +1,17 @@
 import asyncio
 import os
+import shutil
+import signal
 import subprocess
+import time
 
-from typing import Dict
-from utils import pick_available_gpus, parse_command
+from contextlib import nullcontext
+from multiprocessing.connection import Client
+from typing import Dict, List
+from pointclouds import PointCloudConverter, PointCloudError
+from profiler import Profiler, stage_name
+from scheduler import BACKGROUND, INTERACTIVE, GpuScheduler
+from utils import gpu_count, pick_available_gpus, parse_command
 
 conda_source = "/opt/conda/etc/profile.d/conda.sh"
 
@@ -12,6 +20,9 @@ class Model:
     assets_path = "assets"
     model_path = ""
     conda_env = ""
+    priority = BACKGROUND
+    scheduler: GpuScheduler = None
+    profiler: Profiler = None
 
     def __init__(self, asset_id: str, asset_type: str, conda_env: str, model_path: str):
         self.asset_type = asset_type
@@ -20,23 +31,83 @@ class Model:
         self.conda_env = conda_env
         self.model_path = model_path
 
-    def run_command(self, command: str, environment: Dict[str, str] = dict()):
+    def run_command(
+        self, command: str, environment: Dict[str, str] = dict(), priority: str = None
+    ):
+        priority = priority or self.priority
+
+        candidates = None
+        if self.scheduler is not None:
+            candidates = self.scheduler.devices(priority, gpu_count())
+
+        env = os.environ.copy()
+        env["CUDA_VISIBLE_DEVICES"] = ",".join(pick_available_gpus(candidates=candidates))
+
+        for key, value in environment.items():
+            env[key] = value
+
+        devices = [int(i) for i in env["CUDA_VISIBLE_DEVICES"].split(",") if i]
+        command = parse_command(command)
+        stage = stage_name(command)
+        command = self.__append_environment(command)
+
+        # Interactive work pauses background processes on its GPUs if its SLO is at risk
+        if self.scheduler is not None and priority == INTERACTIVE:
+            with self.scheduler.interactive(devices):
+                return self.__run_process(command, env, priority, devices, stage)
+
+        return self.__run_process(command, env, priority, devices, stage)
+
+    def start_command(self, command: str, environment: Dict[str, str] = dict()):
         env = os.environ.copy()
-        env["CUDA_VISIBLE_DEVICES"] = ",".join(pick_available_gpus())
+        env["CUDA_VISIBLE_DEVICES"] = ",".join(pick_available_gpus(1))
 
         for key, value in environment.items():
             env[key] = value
 
         command = self.__append_environment(parse_command(command))
-        process = subprocess.run(
+        return subprocess.Popen(
+            f'bash -c "{command}"',
+            text=True,
+            shell=True,
+            env=env,
+            start_new_session=True,
+        )
+
+    def __run_process(
+        self,
+        command: str,
+        env: Dict[str, str],
+        priority: str,
+        devices: List[int],
+        stage: str,
+    ):
+        process = subprocess.Popen(
             f'bash -c "{command}"',
             text=True,
             shell=True,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             env=env,
+            start_new_session=True,
         )
 
-        return process
+        if self.scheduler is not None:
+            self.scheduler.register(process, priority, devices)
+
+        profile = nullcontext()
+        # Only job stages are profiled, queries are tracked by their latency instead
+        if self.profiler is not None and priority == BACKGROUND:
+            profile = self.profiler.profile(self.asset_id, stage, process.pid, devices)
+
+        try:
+            with profile:
+                stdout, stderr = process.communicate()
+        finally:
+            if self.scheduler is not None:
+                self.scheduler.unregister(process)
+
+        return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
 
     def __append_environment(self, command: str):
         return f"source {conda_source} && conda activate {self.conda_env} && {command} && conda deactivate"
@@ -121,8 +192,92 @@ class PTv3ReconstructionError(Exception):
     pass
 
 
+class PTv3Client:
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+
+    def ping(self):
+        try:
+            return self.__request({"type": "ping"})["status"] == "ok"
+        except (OSError, EOFError):
+            return False
+
+    def infer(self, data_root: str, save_path: str, split: str = "scene"):
+        response = self.__request(
+            {"type": "infer", "data_root": data_root, "save_path": save_path, "split": split}
+        )
+
+        if response["status"] != "ok":
+            raise PTv3InferenceError(response["error"])
+
+        return response["paths"]
+
+    def __request(self, request: dict):
+        with Client(self.address, family="AF_UNIX", authkey=self.authkey) as connection:
+            connection.send(request)
+            return connection.recv()
+
+
+class PTv3Server(Model):
+    def __init__(self, address: str, authkey: bytes, stub: bool = False):
+        Model.__init__(
+            self,
+            asset_id="",
+            asset_type="",
+            conda_env="pointcept",
+            model_path="models/pointcept",
+        )
+
+        self.client = PTv3Client(address, authkey)
+        self.address = address
+        self.authkey = authkey
+        self.stub = stub
+        self.process = None
+
+    def start(self, timeout: float = 300):
+        if self.stub:
+            options = "--stub"
+        else:
+            options = f"""
+                --config-file {os.path.join(self.model_path, "models/ptv3/config.py")}
+                --weight {os.path.join(self.model_path, "models/ptv3/model/model_best.pth")}
+            """
+
+        command = f"""python src/ptv3_server.py
+            --address {self.address}
+            {options}
+        """
+
+        self.process = self.start_command(
+            command,
+            {
+                "PYTHONPATH": "models/pointcept",
+                "PTV3_SERVER_AUTHKEY": self.authkey.decode(),
+            },
+        )
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise PTv3InferenceError("PTv3 server exited during startup")
+            if self.client.ping():
+                return self.client
+            time.sleep(1)
+
+        self.stop()
+        raise PTv3InferenceError("PTv3 server did not become ready")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            self.process.wait()
+
+
 class PTv3(Model):
-    def __init__(self, asset_id: str, asset_type: str):
+    converter: PointCloudConverter = None
+
+    def __init__(self, asset_id: str, asset_type: str, client: PTv3Client = None):
         Model.__init__(
             self,
             asset_id=asset_id,
@@ -132,6 +287,7 @@ class PTv3(Model):
         )
 
         self.asset_path = os.path.join(self.assets_path, asset_id)
+        self.client = client
 
         if self.asset_type == "lidar":
             self.input_path = "input/lidar.ply"
@@ -151,6 +307,17 @@ class PTv3(Model):
         await asyncio.get_event_loop().run_in_executor(None, self.__reconstruct)
 
     def __convert(self):
+        if self.converter is not None:
+            try:
+                self.converter.to_s3dis(
+                    os.path.join(self.asset_path, self.input_path),
+                    os.path.join(self.asset_path, "data"),
+                    "scene",
+                )
+            except (PointCloudError, OSError, ValueError) as e:
+                raise PTv3ConvertError(str(e))
+            return
+
         command = f"""python {os.path.join(self.model_path, "convert_ply.py")}
             -p {os.path.join(self.asset_path, self.input_path)}
             -d {os.path.join(self.asset_path, "data")}
@@ -172,6 +339,13 @@ class PTv3(Model):
             raise PTv3PreprocessError(process.stderr)
 
     def __infer(self):
+        if self.client is not None:
+            self.client.infer(
+                data_root=os.path.join(self.asset_path, "data/scene"),
+                save_path=os.path.join(self.asset_path, "data"),
+            )
+            return
+
         options = {
             "weight": os.path.join(self.model_path, "models/ptv3/model/model_best.pth"),
             "save_path": os.path.join(self.asset_path, "data"),
@@ -191,6 +365,18 @@ class PTv3(Model):
             raise PTv3InferenceError(process.stderr)
 
     def __reconstruct(self):
+        if self.converter is not None:
+            try:
+                self.converter.reconstruct(
+                    os.path.join(self.asset_path, self.input_path),
+                    os.path.join(self.asset_path, "data/result/scene.npy"),
+                    os.path.join(self.asset_path, "segmentation"),
+                    "ptv3",
+                )
+            except (PointCloudError, OSError, ValueError) as e:
+                raise PTv3ReconstructionError(str(e))
+            return
+
         command = f"""python {os.path.join(self.model_path, "convert_npy.py")}
             --input {os.path.join(self.asset_path, self.input_path)}
             --scene {os.path.join(self.asset_path, "data/result/scene.npy")}
@@ -261,6 +447,11 @@ class Saga(Model):
     async def render(self, segment_id: str):
         await asyncio.get_event_loop().run_in_executor(None, self.__render, segment_id)
 
+    async def segment_prompt(self, segment_id: str, image_index: int, x: int, y: int):
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.__segment_prompt, segment_id, image_index, x, y
+        )
+
     def __extract_features(self):
         command = f"""python {os.path.join(self.model_path, "extract_features.py")}
             --sam_checkpoint_path {os.path.join(self.model_path, "sam.pth")}
@@ -305,7 +496,43 @@ class Saga(Model):
     def __segment(
         self, segment_id: str, image_index: int, mask_index: int, x: int, y: int
     ):
-        command = f"""python {os.path.join(self.model_path, "prompt_segmenting.py")}
+        command = self.__segment_command(segment_id, image_index, mask_index, x, y)
+
+        process = self.run_command(command, priority=INTERACTIVE)
+        if process.returncode != 0:
+            raise SagaSegmentError(process.stderr)
+
+    def __render(self, segment_id: str):
+        command = self.__render_command(segment_id)
+
+        process = self.run_command(command, priority=INTERACTIVE)
+        if process.returncode != 0:
+            raise SagaRenderError(process.stderr)
+
+    def __segment_prompt(self, segment_id: str, image_index: int, x: int, y: int):
+        self.__segment(segment_id, image_index, 1, x, y)
+        if not os.path.exists(os.path.join(self.asset_path, "saga/segmentation", segment_id)):
+            raise SagaSegmentError(f"saga/segmentation/{segment_id} not found")
+
+        self.__render(segment_id)
+
+        output_path = os.path.join(
+            self.asset_path,
+            "saga/point_cloud/iteration_7000/segmentation",
+            "segmentation_seg_no_mask_point_cloud.ply",
+        )
+        if not os.path.exists(output_path):
+            raise SagaRenderError("segmentation_seg_no_mask_point_cloud.ply not found")
+
+        # Render writes to a fixed path, so the result is copied out before the next prompt
+        target_path = os.path.join("saga/segmentation", segment_id, "segmentation.ply")
+        shutil.copyfile(output_path, os.path.join(self.asset_path, target_path))
+        return target_path
+
+    def __segment_command(
+        self, segment_id: str, image_index: int, mask_index: int, x: int, y: int
+    ):
+        return f"""python {os.path.join(self.model_path, "prompt_segmenting.py")}
             --sam_checkpoint_path {os.path.join(self.model_path, "sam.pth")}
             --image_root {self.asset_path}
             --mask_idx {mask_index}
@@ -316,18 +543,10 @@ class Saga(Model):
             --iterations 7000
         """
 
-        process = self.run_command(command)
-        if process.returncode != 0:
-            raise SagaSegmentError(process.stderr)
-
-    def __render(self, segment_id: str):
-        command = f"""python {os.path.join(self.model_path, "render.py")}
+    def __render_command(self, segment_id: str):
+        return f"""python {os.path.join(self.model_path, "render.py")}
             --m {os.path.join(self.asset_path, "saga")}
             --precomputed_mask {os.path.join(self.asset_path, "saga/segmentation", segment_id, "final_mask.pt")}
             --target scene
             --segment
         """
-
-        process = self.run_command(command)
-        if process.returncode != 0:
-            raise SagaRenderError(process.stderr)
@@ -0,0 +1,317 @@
+import os
+import shutil
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import List, Tuple
+
+ply_types = {
+    "char": "i1",
+    "int8": "i1",
+    "uchar": "u1",
+    "uint8": "u1",
+    "short": "i2",
+    "int16": "i2",
+    "ushort": "u2",
+    "uint16": "u2",
+    "int": "i4",
+    "int32": "i4",
+    "uint": "u4",
+    "uint32": "u4",
+    "float": "f4",
+    "float32": "f4",
+    "double": "f8",
+    "float64": "f8",
+}
+
+# Zeroth order spherical harmonic, used to turn gaussian colours into RGB
+sh_c0 = 0.28209479177387814
+
+# Colours of the S3DIS classes predicted by PTv3, in label order
+s3dis_palette = np.array(
+    [
+        [0, 255, 0],  # ceiling
+        [0, 0, 255],  # floor
+        [0, 255, 255],  # wall
+        [255, 255, 0],  # beam
+        [255, 0, 255],  # column
+        [100, 100, 255],  # window
+        [200, 200, 100],  # door
+        [170, 120, 200],  # table
+        [255, 0, 0],  # chair
+        [200, 100, 100],  # sofa
+        [10, 200, 100],  # bookcase
+        [200, 200, 200],  # board
+        [50, 50, 50],  # clutter
+    ],
+    dtype=np.uint8,
+)
+
+output_dtype = np.dtype(
+    [
+        ("x", "<f4"),
+        ("y", "<f4"),
+        ("z", "<f4"),
+        ("red", "u1"),
+        ("green", "u1"),
+        ("blue", "u1"),
+        ("label", "<i4"),
+    ]
+)
+
+
+class PointCloudError(Exception):
+    pass
+
+
+class PointCloudConverter:
+    def __init__(self, workers: int = None, chunk_size: int = 1 << 20):
+        self.workers = workers or len(os.sched_getaffinity(0))
+        self.chunk_size = max(1, chunk_size)
+        self.pool = None
+
+    def to_s3dis(self, ply_path: str, data_path: str, name: str = "scene"):
+        # Pointcept reads S3DIS as <root>/<area>/<room>/Annotations/<class>_<i>.txt with
+        # one alignment file per area, so the whole cloud becomes one clutter object
+        area_path = os.path.join(data_path, name, name)
+        room_path = os.path.join(area_path, name)
+        annotations_path = os.path.join(room_path, "Annotations")
+        os.makedirs(annotations_path, exist_ok=True)
+
+        source, count = self.__open(ply_path, room_path)
+        chunks = self.__chunks(count)
+        parts = [os.path.join(room_path, f".{name}.{i}.part") for i in range(len(chunks))]
+
+        try:
+            self.__map(
+                format_chunk,
+                [(source, start, stop, part) for (start, stop), part in zip(chunks, parts)],
+            )
+
+            room_file = os.path.join(room_path, f"{name}.txt")
+            with open(room_file, "wb") as output:
+                for part in parts:
+                    with open(part, "rb") as f:
+                        shutil.copyfileobj(f, output)
+
+            object_file = os.path.join(annotations_path, "clutter_1.txt")
+            if os.path.exists(object_file):
+                os.remove(object_file)
+            os.link(room_file, object_file)
+
+        finally:
+            for part in parts:
+                if os.path.exists(part):
+                    os.remove(part)
+            self.__close(source)
+
+        with open(os.path.join(area_path, f"{name}_alignmentAngle.txt"), "w") as f:
+            f.write(f"## Global alignment angle per disjoint space in {name} ##\n")
+            f.write(f"{name} 1 0\n")
+
+    def reconstruct(
+        self, ply_path: str, labels_path: str, destination_path: str, name: str
+    ):
+        os.makedirs(destination_path, exist_ok=True)
+        output_path = os.path.join(destination_path, f"{name}.ply")
+
+        source, count = self.__open(ply_path, destination_path)
+        try:
+            labels = np.load(labels_path, mmap_mode="r")
+            if labels.shape[0] != count:
+                raise PointCloudError(
+                    f"{labels.shape[0]} labels for a point cloud of {count} points"
+                )
+
+            header = write_header(output_path, count)
+            with open(output_path, "r+b") as f:
+                f.truncate(header + count * output_dtype.itemsize)
+
+            self.__map(
+                color_chunk,
+                [
+                    (source, labels_path, start, stop, output_path, header, count)
+                    for start, stop in self.__chunks(count)
+                ],
+            )
+
+        finally:
+            self.__close(source)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __map(self, func, tasks: List[tuple]):
+        if self.workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                func(*task)
+            return
+
+        # Spawned workers do not inherit the locks held by the runner's threads
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"))
+
+        for _ in self.pool.map(func, *zip(*tasks)):
+            pass
+
+    def __chunks(self, count: int) -> List[Tuple[int, int]]:
+        return [
+            (start, min(count, start + self.chunk_size))
+            for start in range(0, count, self.chunk_size)
+        ]
+
+    def __open(self, ply_path: str, temp_path: str):
+        fmt, dtype, count, offset = read_header(ply_path)
+        if fmt != "ascii":
+            return ("ply", ply_path, dtype.descr, offset, count), count
+
+        # ASCII clouds are parsed once into a temporary array the workers can map
+        points = np.loadtxt(
+            ply_path, dtype=dtype, skiprows=offset, max_rows=count, ndmin=1
+        )
+        npy_path = os.path.join(temp_path, f".{os.path.basename(ply_path)}.npy")
+        np.save(npy_path, points)
+        return ("npy", npy_path), count
+
+    def __close(self, source: tuple):
+        if source[0] == "npy" and os.path.exists(source[1]):
+            os.remove(source[1])
+
+
+def read_header(ply_path: str):
+    with open(ply_path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise PointCloudError(f"{ply_path} is not a PLY file")
+
+        fmt, elements, count, fields, lines = None, [], 0, [], 1
+        while True:
+            line = f.readline()
+            lines += 1
+            if not line:
+                raise PointCloudError(f"{ply_path} has no end_header")
+
+            words = line.decode("ascii").split()
+            if not words or words[0] in ("comment", "obj_info"):
+                continue
+            if words[0] == "end_header":
+                break
+
+            if words[0] == "format":
+                fmt = words[1]
+            elif words[0] == "element":
+                elements.append(words[1])
+                if words[1] == "vertex":
+                    count = int(words[2])
+            elif words[0] == "property" and elements[-1] == "vertex":
+                if words[1] == "list":
+                    raise PointCloudError(f"{ply_path} has list vertex properties")
+                fields.append((words[2], ply_types[words[1]]))
+
+        # Elements after the vertices, such as faces, are never read
+        if not elements or elements[0] != "vertex":
+            raise PointCloudError(f"{ply_path} does not start with vertices")
+
+        if fmt == "ascii":
+            return fmt, np.dtype(fields), count, lines
+
+        endian = "<" if fmt == "binary_little_endian" else ">"
+        dtype = np.dtype([(field, endian + kind) for field, kind in fields])
+        return fmt, dtype, count, f.tell()
+
+
+def write_header(output_path: str, count: int):
+    header = "\n".join(
+        [
+            "ply",
+            "format binary_little_endian 1.0",
+            f"element vertex {count}",
+            "property float x",
+            "property float y",
+            "property float z",
+            "property uchar red",
+            "property uchar green",
+            "property uchar blue",
+            "property int label",
+            "end_header",
+            "",
+        ]
+    ).encode("ascii")
+
+    with open(output_path, "wb") as f:
+        f.write(header)
+    return len(header)
+
+
+def load_points(source: tuple):
+    if source[0] == "npy":
+        return np.load(source[1], mmap_mode="r")
+
+    _, path, descr, offset, count = source
+    return np.memmap(path, dtype=np.dtype(descr), mode="r", offset=offset, shape=(count,))
+
+
+def point_colors(points: np.ndarray):
+    names = points.dtype.names
+    if all(channel in names for channel in ("red", "green", "blue")):
+        colors = np.stack([points["red"], points["green"], points["blue"]], axis=1)
+        if colors.dtype.kind == "f" and colors.max(initial=0) <= 1:
+            colors = colors * 255
+        return np.clip(colors, 0, 255).astype(np.uint8)
+
+    if all(channel in names for channel in ("f_dc_0", "f_dc_1", "f_dc_2")):
+        dc = np.stack([points["f_dc_0"], points["f_dc_1"], points["f_dc_2"]], axis=1)
+        return (np.clip(0.5 + sh_c0 * dc, 0, 1) * 255).astype(np.uint8)
+
+    return np.zeros((len(points), 3), dtype=np.uint8)
+
+
+def format_chunk(source: tuple, start: int, stop: int, part_path: str):
+    points = load_points(source)[start:stop]
+
+    table = np.empty((len(points), 6), dtype=np.float64)
+    table[:, 0] = points["x"]
+    table[:, 1] = points["y"]
+    table[:, 2] = points["z"]
+    table[:, 3:] = point_colors(points)
+
+    # One format over the flattened chunk is much faster than formatting row by row
+    row = "%.6f %.6f %.6f %d %d %d\n"
+    with open(part_path, "w") as f:
+        f.write((row * len(table)) % tuple(table.ravel().tolist()))
+
+
+def color_chunk(
+    source: tuple,
+    labels_path: str,
+    start: int,
+    stop: int,
+    output_path: str,
+    offset: int,
+    count: int,
+):
+    points = load_points(source)[start:stop]
+    labels = np.load(labels_path, mmap_mode="r")[start:stop]
+    if labels.ndim > 1:
+        labels = labels.argmax(axis=1)
+    labels = labels.astype(np.int32)
+
+    known = (labels >= 0) & (labels < len(s3dis_palette))
+    colors = np.zeros((len(labels), 3), dtype=np.uint8)
+    colors[known] = s3dis_palette[labels[known]]
+
+    output = np.memmap(
+        output_path, dtype=output_dtype, mode="r+", offset=offset, shape=(count,)
+    )
+    chunk = output[start:stop]
+    chunk["x"] = points["x"]
+    chunk["y"] = points["y"]
+    chunk["z"] = points["z"]
+    chunk["red"] = colors[:, 0]
+    chunk["green"] = colors[:, 1]
+    chunk["blue"] = colors[:, 2]
+    chunk["label"] = labels
+    output.flush()
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from typing import Dict, List, Optional
+from urllib import request
+from urllib.error import HTTPError
+
+
+class PreflightError(Exception):
+    pass
+
+
+class Preflight:
+    def __init__(
+        self,
+        conda_source: str,
+        cache_path: str = "preflight.json",
+        warm: bool = False,
+        timeout: float = 300,
+    ):
+        self.conda_source = conda_source
+        self.conda_root = os.path.dirname(os.path.dirname(os.path.dirname(conda_source)))
+        self.cache_path = cache_path
+        self.warm = warm
+        self.timeout = timeout
+
+        self.checks = []
+        self.results: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.cache: Dict[str, List[int]] = self.__load()
+
+    def add_environment(self, env: str, commands: List[str] = [], modules: List[str] = []):
+        self.checks.append((f"environment {env}", self.__environment, env, commands, modules))
+
+    def add_checkpoint(self, path: str):
+        self.checks.append((f"checkpoint {path}", self.__checkpoint, path))
+
+    def add_endpoint(self, url: str):
+        self.checks.append((f"endpoint {url}", self.__endpoint, url))
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(
+            *[loop.run_in_executor(None, self.__run, *check) for check in self.checks]
+        )
+        self.__save()
+
+        failures = [name for name, result in self.results.items() if not result["ok"]]
+        if failures:
+            raise PreflightError(
+                "; ".join(f"{name}: {self.results[name]['detail']}" for name in failures)
+            )
+
+    def report(self):
+        with self.lock:
+            return {name: dict(result) for name, result in self.results.items()}
+
+    def __run(self, name: str, check, *args):
+        start_time = time.time()
+        try:
+            ok, detail, cached = check(name, *args)
+        except Exception as e:
+            ok, detail, cached = False, str(e), False
+
+        duration = time.time() - start_time
+        with self.lock:
+            self.results[name] = {
+                "ok": ok,
+                "detail": detail,
+                "cached": cached,
+                "duration": duration,
+            }
+
+        if ok:
+            source = "cached" if cached else f"{duration:.2f} seconds"
+            logging.info(f"└- {name}: ok ({source})")
+        else:
+            logging.error(f"└- {name}: {detail}")
+
+    def __environment(self, name: str, env: str, commands: List[str], modules: List[str]):
+        # Installing into an environment updates its history, which invalidates the cache
+        key = self.__key(os.path.join(self.conda_root, "envs", env, "conda-meta", "history"))
+        if key is None:
+            return False, "conda environment not found", False
+
+        cached = self.__cached(name, key)
+        if cached and not self.warm:
+            return True, "", True
+
+        # Activating the environment and importing its modules also warms the page cache
+        steps = [f"source {self.conda_source}", f"conda activate {env}"]
+        steps += [
+            f"{{ command -v {command} > /dev/null || {{ echo '{command} not found' >&2; false; }}; }}"
+            for command in commands
+        ]
+        if modules:
+            steps.append(f"python -c 'import {', '.join(modules)}'")
+
+        process = subprocess.run(
+            ["bash", "-c", " && ".join(steps)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=self.timeout,
+        )
+        if process.returncode != 0:
+            return False, process.stderr.strip()[-500:], False
+
+        self.__store(name, key)
+        return True, "", cached
+
+    def __checkpoint(self, name: str, path: str):
+        key = self.__key(path)
+        if key is None:
+            return False, "file not found", False
+        if key[1] == 0:
+            return False, "file is empty", False
+
+        cached = self.__cached(name, key)
+        if not cached:
+            # Reading the first bytes catches unreadable files, a full read is left to warming
+            with open(path, "rb") as f:
+                f.read(1024)
+            self.__store(name, key)
+
+        if self.warm:
+            self.__preload(path)
+        return True, "", cached
+
+    def __endpoint(self, name: str, url: str):
+        # Any answer from the server, including an error status, means it is reachable
+        try:
+            request.urlopen(url, timeout=10).close()
+        except HTTPError as e:
+            if e.code >= 500:
+                return False, f"server error {e.code}", False
+        return True, "", False
+
+    def __preload(self, path: str):
+        with open(path, "rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            while f.read(16 * 1024 * 1024):
+                pass
+
+    def __key(self, path: str) -> Optional[List[int]]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def __cached(self, name: str, key: List[int]):
+        with self.lock:
+            return self.cache.get(name) == key
+
+    def __store(self, name: str, key: List[int]):
+        with self.lock:
+            self.cache[name] = key
+
+    def __load(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def __save(self):
+        with self.lock:
+            cache = dict(self.cache)
+
+        with open(f"{self.cache_path}.tmp", "w") as f:
+            json.dump(cache, f)
+        os.replace(f"{self.cache_path}.tmp", self.cache_path)
@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class NvmlBackend:
+    def __init__(self):
+        import pynvml
+
+        self.nvml = pynvml
+
+    def sample(self, devices: List[int]):
+        self.nvml.nvmlInit()
+        try:
+            samples = []
+            for i in devices:
+                handle = self.nvml.nvmlDeviceGetHandleByIndex(i)
+                memory_info = self.nvml.nvmlDeviceGetMemoryInfo(handle)
+                compute_util = self.nvml.nvmlDeviceGetUtilizationRates(handle)
+                samples.append(
+                    {
+                        "index": i,
+                        "utilization": compute_util.gpu,
+                        "memory_used": memory_info.used,
+                    }
+                )
+            return samples
+        finally:
+            self.nvml.nvmlShutdown()
+
+
+class FakeGpuBackend:
+    def __init__(self, utilization: List[float] = [0], memory_used: List[int] = [0]):
+        self.utilization = utilization
+        self.memory_used = memory_used
+        self.calls = 0
+
+    def sample(self, devices: List[int]):
+        # Cycles through the given values so tests can script busy and idle periods, and
+        # stands in for GPUs on machines without NVML
+        utilization = self.utilization[self.calls % len(self.utilization)]
+        memory_used = self.memory_used[self.calls % len(self.memory_used)]
+        self.calls += 1
+        return [
+            {"index": i, "utilization": utilization, "memory_used": memory_used}
+            for i in devices
+        ]
+
+
+class ProcessTree:
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.counters: Dict[int, tuple] = {}
+        self.last_time = None
+
+    def pids(self):
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+
+            stat = self.__read(f"/proc/{entry}/stat")
+            if stat is None:
+                continue
+
+            # The command name may contain spaces, so fields are counted from its end
+            fields = stat[stat.rfind(")") + 2 :].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+
+        pids, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            stack.extend(children.get(pid, []))
+        return pids
+
+    def sample(self):
+        now = time.time()
+        cpu_time = 0
+        rss = 0
+        read_bytes = 0
+        write_bytes = 0
+
+        pids = self.pids()
+        counters = {}
+        for pid in pids:
+            stat = self.__read(f"/proc/{pid}/stat")
+            statm = self.__read(f"/proc/{pid}/statm")
+            if stat is None or statm is None:
+                continue
+
+            fields = stat[stat.rfind(")") + 2 :].split()
+            ticks = int(fields[11]) + int(fields[12])
+            io = self.__io(pid)
+
+            # Processes that exited between samples simply drop out of the deltas
+            previous = self.counters.get(pid, (0, 0, 0) if self.last_time else (ticks, *io))
+            cpu_time += ticks - previous[0]
+            read_bytes += io[0] - previous[1]
+            write_bytes += io[1] - previous[2]
+            rss += int(statm.split()[1]) * self.page_size
+            counters[pid] = (ticks, *io)
+
+        elapsed = now - self.last_time if self.last_time else None
+        self.counters = counters
+        self.last_time = now
+
+        return {
+            "processes": len(counters),
+            "cpu": (cpu_time / self.clock_ticks / elapsed * 100) if elapsed else 0,
+            "rss": rss,
+            "read_bytes": read_bytes,
+            "write_bytes": write_bytes,
+        }
+
+    def __io(self, pid: int):
+        io = self.__read(f"/proc/{pid}/io")
+        if io is None:
+            return (0, 0)
+
+        values = dict(line.split(": ") for line in io.splitlines() if ": " in line)
+        return (int(values.get("read_bytes", 0)), int(values.get("write_bytes", 0)))
+
+    def __read(self, path: str) -> Optional[str]:
+        try:
+            with open(path) as f:
+                return f.read()
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return None
+
+
+class Profiler:
+    def __init__(
+        self,
+        output_path: str = "profiles",
+        interval: float = 1,
+        gpu_backend=None,
+        idle_utilization: float = 5,
+        idle_gap: float = 5,
+    ):
+        self.output_path = output_path
+        self.interval = interval
+        self.gpu_backend = gpu_backend
+        self.idle_utilization = idle_utilization
+        self.idle_gap = idle_gap
+
+        self.timelines: Dict[str, List[dict]] = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def profile(self, job_id: str, stage: str, pid: int, devices: List[int]):
+        stop = threading.Event()
+        record = {"stage": stage, "start": time.time(), "end": None, "samples": []}
+        with self.lock:
+            self.timelines.setdefault(job_id, []).append(record)
+
+        sampler = threading.Thread(
+            target=self.__sample, args=(record, ProcessTree(pid), devices, stop), daemon=True
+        )
+        sampler.start()
+
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+            record["end"] = time.time()
+
+    def save(self, job_id: str):
+        with self.lock:
+            stages = self.timelines.pop(job_id, [])
+        if not stages:
+            return None
+
+        summary = self.summarize(stages)
+        os.makedirs(self.output_path, exist_ok=True)
+        path = os.path.join(self.output_path, f"{job_id}-{int(stages[0]['start'])}.json")
+        with open(path, "w") as f:
+            json.dump({"job_id": job_id, "summary": summary, "stages": stages}, f)
+
+        for stage in summary["stages"]:
+            logging.info(
+                f"└- {stage['stage']}: {stage['duration']:.2f}s, "
+                f"cpu {stage['mean_cpu']:.0f}%, "
+                f"peak rss {stage['peak_rss'] / 1024 ** 3:.2f}GB, "
+                f"peak gpu {stage['peak_gpu_memory'] / 1024 ** 3:.2f}GB, "
+                f"gpu idle {stage['gpu_idle']:.2f}s"
+            )
+        logging.info(f"└- Profile saved to {path}")
+        return path
+
+    def summarize(self, stages: List[dict]):
+        summary = []
+        for stage in stages:
+            samples = stage["samples"]
+            summary.append(
+                {
+                    "stage": stage["stage"],
+                    "duration": stage["end"] - stage["start"],
+                    "mean_cpu": (
+                        sum(sample["cpu"] for sample in samples) / len(samples)
+                        if samples
+                        else 0
+                    ),
+                    "peak_rss": max((sample["rss"] for sample in samples), default=0),
+                    "peak_gpu_memory": max(
+                        (self.__gpu_memory(sample) for sample in samples), default=0
+                    ),
+                    "read_bytes": sum(sample["read_bytes"] for sample in samples),
+                    "write_bytes": sum(sample["write_bytes"] for sample in samples),
+                    "gpu_idle": sum(end - start for start, end in self.__idle(stage)),
+                    "idle_gaps": self.__idle(stage),
+                }
+            )
+
+        # Time between stages is idle for every resource the job holds
+        gaps = [
+            [previous["end"], current["start"]]
+            for previous, current in zip(stages, stages[1:])
+            if current["start"] - previous["end"] >= self.idle_gap
+        ]
+
+        return {
+            "duration": stages[-1]["end"] - stages[0]["start"],
+            "stages": summary,
+            "idle_gaps": gaps,
+        }
+
+    def __sample(self, record: dict, tree: ProcessTree, devices: List[int], stop):
+        while True:
+            sample = {"time": time.time(), **tree.sample()}
+            if self.gpu_backend is not None and devices:
+                try:
+                    sample["gpus"] = self.gpu_backend.sample(devices)
+                except Exception as e:
+                    logging.warning(f"└- Failed sampling GPUs: {e}")
+            record["samples"].append(sample)
+
+            if stop.wait(self.interval):
+                break
+
+    def __idle(self, stage: dict):
+        gaps = []
+        start = None
+        for sample in stage["samples"]:
+            gpus = sample.get("gpus")
+            if not gpus:
+                continue
+
+            idle = max(gpu["utilization"] for gpu in gpus) < self.idle_utilization
+            if idle and start is None:
+                start = sample["time"]
+            elif not idle and start is not None:
+                if sample["time"] - start >= self.idle_gap:
+                    gaps.append([start, sample["time"]])
+                start = None
+
+        if start is not None and stage["end"] - start >= self.idle_gap:
+            gaps.append([start, stage["end"]])
+        return gaps
+
+    def __gpu_memory(self, sample: dict):
+        return sum(gpu["memory_used"] for gpu in sample.get("gpus", []))
+
+
+def stage_name(command: str):
+    # Stages are named after the script they run, e.g. train_scene, or the tool
+    words = command.split()
+    for word in words:
+        if word.endswith(".py"):
+            return os.path.splitext(os.path.basename(word))[0]
+    return " ".join(words[:2])
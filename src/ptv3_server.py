@@ -0,0 +1,273 @@
+import argparse
+import copy
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from multiprocessing.connection import Listener
+
+
+class PTv3Engine:
+    def __init__(self, config_file: str, weight: str, options: dict):
+        import torch
+
+        from pointcept.datasets import collate_fn
+        from pointcept.engines.defaults import default_config_parser
+        from pointcept.models import build_model
+
+        self.torch = torch
+        self.collate_fn = collate_fn
+
+        self.cfg = default_config_parser(config_file, options)
+        self.num_classes = self.cfg.data.num_classes
+
+        self.model = build_model(self.cfg.model).cuda()
+        checkpoint = torch.load(weight, map_location="cuda")
+        state_dict = {
+            (key[7:] if key.startswith("module.") else key): value
+            for key, value in checkpoint["state_dict"].items()
+        }
+        self.model.load_state_dict(state_dict, strict=True)
+        self.model.eval()
+
+    def load(self, data_root: str, split: str):
+        from pointcept.datasets import build_dataset
+
+        dataset_cfg = copy.deepcopy(self.cfg.data.test)
+        dataset_cfg.data_root = data_root
+        dataset_cfg.split = split
+        dataset = build_dataset(dataset_cfg)
+
+        scenes = []
+        for index in range(len(dataset)):
+            data_dict = dataset[index]
+            scenes.append(
+                {
+                    "name": data_dict.pop("name"),
+                    "fragments": data_dict.pop("fragment_list"),
+                    "size": data_dict.pop("segment").size,
+                    "inverse": data_dict.pop("inverse", None),
+                }
+            )
+        return scenes
+
+    def infer(self, scenes: list, max_batch_points: int):
+        torch = self.torch
+
+        predictions = [
+            torch.zeros((scene["size"], self.num_classes)).cuda() for scene in scenes
+        ]
+
+        # Fragments of every scene in the batch are packed together so that small
+        # scenes share a single forward pass
+        fragments = [
+            (scene_index, fragment)
+            for scene_index, scene in enumerate(scenes)
+            for fragment in scene["fragments"]
+        ]
+
+        batch, batch_points = [], 0
+        for item in fragments + [None]:
+            if item is not None:
+                points = len(item[1]["coord"])
+                if not batch or batch_points + points <= max_batch_points:
+                    batch.append(item)
+                    batch_points += points
+                    continue
+
+            if batch:
+                self.__forward(batch, predictions)
+
+            if item is not None:
+                batch, batch_points = [item], len(item[1]["coord"])
+            else:
+                batch = []
+
+        labels = []
+        for scene, prediction in zip(scenes, predictions):
+            label = prediction.max(1)[1].data.cpu().numpy()
+            if scene["inverse"] is not None:
+                label = label[scene["inverse"]]
+            labels.append(label)
+        return labels
+
+    def __forward(self, batch: list, predictions: list):
+        torch = self.torch
+
+        input_dict = self.collate_fn([fragment for _, fragment in batch])
+        for key in input_dict.keys():
+            if isinstance(input_dict[key], torch.Tensor):
+                input_dict[key] = input_dict[key].cuda(non_blocking=True)
+
+        with torch.no_grad():
+            seg_logits = self.model(input_dict)["seg_logits"]
+            seg_logits = torch.softmax(seg_logits, -1)
+
+        start = 0
+        for (scene_index, _), end in zip(batch, input_dict["offset"].tolist()):
+            index = input_dict["index"][start:end]
+            predictions[scene_index][index] += seg_logits[start:end]
+            start = end
+
+
+class StubEngine:
+    def load(self, data_root: str, split: str):
+        scenes = []
+        for path in sorted(glob.glob(os.path.join(data_root, split, "*.pth"))):
+            size = self.__count_points(path)
+            name = os.path.splitext(os.path.basename(path))[0]
+            scenes.append({"name": name, "fragments": [], "size": size})
+        return scenes
+
+    def infer(self, scenes: list, max_batch_points: int):
+        return [np.zeros(scene["size"], dtype=np.int64) for scene in scenes]
+
+    def __count_points(self, path: str):
+        import torch
+
+        return len(torch.load(path, map_location="cpu")["coord"])
+
+
+class PTv3Server:
+    def __init__(
+        self,
+        engine,
+        address: str,
+        authkey: bytes,
+        batch_window: float,
+        max_batch_points: int,
+    ):
+        self.engine = engine
+        self.address = address
+        self.authkey = authkey
+        self.batch_window = batch_window
+        self.max_batch_points = max_batch_points
+        self.requests = queue.Queue()
+
+    def serve(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        threading.Thread(target=self.__process, daemon=True).start()
+
+        with Listener(self.address, family="AF_UNIX", authkey=self.authkey) as listener:
+            logging.info(f"PTv3 server listening on {self.address}")
+            while True:
+                connection = listener.accept()
+                threading.Thread(
+                    target=self.__handle, args=(connection,), daemon=True
+                ).start()
+
+    def __handle(self, connection):
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except EOFError:
+                    return
+
+                if request.get("type") == "ping":
+                    connection.send({"status": "ok"})
+                    continue
+
+                reply = queue.Queue(maxsize=1)
+                self.requests.put((request, reply))
+                connection.send(reply.get())
+
+    def __process(self):
+        while True:
+            batch = [self.requests.get()]
+
+            # Wait a short window for other requests so their scenes can share the GPU
+            deadline = time.time() + self.batch_window
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.__run(batch)
+
+    def __run(self, batch: list):
+        loaded = []
+        for request, reply in batch:
+            try:
+                scenes = self.engine.load(request["data_root"], request["split"])
+                loaded.append((request, reply, scenes))
+            except Exception as e:
+                reply.put({"status": "error", "error": str(e)})
+
+        if not loaded:
+            return
+
+        start_time = time.time()
+        try:
+            labels = self.engine.infer(
+                [scene for _, _, scenes in loaded for scene in scenes],
+                self.max_batch_points,
+            )
+        except Exception as e:
+            for _, reply, _ in loaded:
+                reply.put({"status": "error", "error": str(e)})
+            return
+
+        duration = time.time() - start_time
+        logging.info(
+            f"Inferred {len(labels)} scenes from {len(loaded)} requests in {duration:.2f} seconds"
+        )
+
+        for request, reply, scenes in loaded:
+            scene_labels, labels = labels[: len(scenes)], labels[len(scenes) :]
+            result = {}
+            try:
+                result_path = os.path.join(request["save_path"], "result")
+                os.makedirs(result_path, exist_ok=True)
+                for scene, label in zip(scenes, scene_labels):
+                    path = os.path.join(result_path, f"{scene['name']}.npy")
+                    np.save(path, label)
+                    result[scene["name"]] = path
+            except Exception as e:
+                reply.put({"status": "error", "error": str(e)})
+                continue
+
+            # Labels are read back from the saved files, so only their paths are sent
+            reply.put({"status": "ok", "paths": result})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", required=True)
+    parser.add_argument("--config-file", default=None)
+    parser.add_argument("--weight", default=None)
+    parser.add_argument("--batch-window", type=float, default=0.5)
+    parser.add_argument("--max-batch-points", type=int, default=400000)
+    parser.add_argument("--stub", action="store_true")
+    parser.add_argument("--options", nargs="*", default=[])
+    args = parser.parse_args()
+
+    log_format = "%(asctime)s [%(levelname)s]: (%(name)s) %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_format)
+
+    if args.stub:
+        engine = StubEngine()
+    else:
+        options = dict(option.split("=", 1) for option in args.options)
+        engine = PTv3Engine(args.config_file, args.weight, options)
+
+    authkey = os.getenv("PTV3_SERVER_AUTHKEY", "segment3d").encode()
+    server = PTv3Server(
+        engine=engine,
+        address=args.address,
+        authkey=authkey,
+        batch_window=args.batch_window,
+        max_batch_points=args.max_batch_points,
+    )
+    server.serve()
@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+import os
+import shutil
+
+from typing import Awaitable, Callable, Dict
+
+from scenes import Scene
+
+
+class SegmentationCache:
+    results_path = "saga/results"
+
+    def __init__(self, quantization: int = 4):
+        self.quantization = max(1, quantization)
+        self.in_flight: Dict[str, asyncio.Future] = {}
+
+    def key(self, scene: Scene, image_index: int, x: int, y: int):
+        qx = int(x) // self.quantization
+        qy = int(y) // self.quantization
+
+        version = ":".join(str(part) for part in scene.version)
+        content = f"{scene.asset_id}:{version}:{image_index}:{qx}:{qy}"
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def path(self, key: str):
+        return os.path.join(self.results_path, f"{key}.ply")
+
+    def pending(self, asset_path: str, key: str):
+        return (
+            os.path.exists(os.path.join(asset_path, self.path(key)))
+            or f"{asset_path}:{key}" in self.in_flight
+        )
+
+    async def get_or_compute(
+        self, asset_path: str, key: str, compute: Callable[[], Awaitable[str]]
+    ):
+        result_path = self.path(key)
+        if os.path.exists(os.path.join(asset_path, result_path)):
+            return result_path, True
+
+        # Identical queries already being computed share the same result
+        in_flight_key = f"{asset_path}:{key}"
+        if in_flight_key in self.in_flight:
+            await asyncio.shield(self.in_flight[in_flight_key])
+            return result_path, True
+
+        future = asyncio.get_event_loop().create_future()
+        self.in_flight[in_flight_key] = future
+
+        try:
+            output_path = await compute()
+            self.__store(asset_path, output_path, result_path)
+            future.set_result(result_path)
+
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+
+        finally:
+            del self.in_flight[in_flight_key]
+
+        return result_path, False
+
+    def clear(self, asset_path: str):
+        shutil.rmtree(os.path.join(asset_path, self.results_path), ignore_errors=True)
+
+    def __store(self, asset_path: str, output_path: str, result_path: str):
+        target = os.path.join(asset_path, result_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        temporary = f"{target}.tmp"
+        shutil.copyfile(os.path.join(asset_path, output_path), temporary)
+        os.replace(temporary, target)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import random
+
+from typing import Callable, Dict, Optional
+
+from aio_pika import DeliveryMode, Message
+from aio_pika.abc import AbstractChannel
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        attempts: int,
+        base_delay: float,
+        max_delay: float,
+        factor: float = 2.0,
+        jitter: float = 0.1,
+    ):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+
+    def delay(self, attempt: int, jitter: bool = True):
+        delay = min(self.max_delay, self.base_delay * self.factor ** (attempt - 1))
+        if jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return delay
+
+    async def run(
+        self, func, *args, retry_if: Callable[[Exception], bool] = lambda e: True
+    ):
+        attempt = 1
+        while True:
+            try:
+                return await func(*args)
+
+            except Exception as e:
+                if attempt >= self.attempts or not retry_if(e):
+                    raise
+
+                delay = self.delay(attempt)
+                logging.warning(
+                    f"└- Attempt {attempt}/{self.attempts} of {func.__name__} failed, "
+                    f"retrying in {delay:.1f} seconds: {e}"
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+
+
+class RetryQueue:
+    def __init__(self, channel: AbstractChannel, queue_name: str, policy: RetryPolicy):
+        self.channel = channel
+        self.queue_name = queue_name
+        self.policy = policy
+        self.declared: Dict[int, str] = {}
+
+    @property
+    def dead_letter_queue_name(self):
+        return f"{self.queue_name}.dead"
+
+    async def declare(self):
+        await self.channel.declare_queue(self.dead_letter_queue_name, durable=True)
+
+    async def retry(
+        self,
+        body: bytes,
+        attempt: int,
+        reason: str,
+        headers: Optional[dict] = None,
+        permanent: bool = False,
+    ):
+        headers = {**(headers or {}), "x-attempts": attempt, "x-failure-reason": reason}
+
+        if permanent:
+            logging.error(
+                f"└- Not retrying a permanent failure, moving message to "
+                f"{self.dead_letter_queue_name}"
+            )
+            await self.__publish(self.dead_letter_queue_name, body, headers)
+            return False
+
+        if attempt >= self.policy.attempts:
+            logging.error(
+                f"└- Giving up after {attempt} attempts, moving message to "
+                f"{self.dead_letter_queue_name}"
+            )
+            await self.__publish(self.dead_letter_queue_name, body, headers)
+            return False
+
+        queue_name = await self.__retry_queue(attempt)
+        logging.info(f"└- Retrying through {queue_name}")
+        await self.__publish(queue_name, body, headers)
+        return True
+
+    async def __retry_queue(self, attempt: int):
+        if attempt in self.declared:
+            return self.declared[attempt]
+
+        # One queue per attempt keeps every message in it on the same delay, which
+        # RabbitMQ needs to expire them in order
+        delay = self.policy.delay(attempt, jitter=False)
+        queue_name = f"{self.queue_name}.retry.{int(delay)}s"
+        await self.channel.declare_queue(
+            queue_name,
+            durable=True,
+            arguments={
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": self.queue_name,
+                "x-message-ttl": int(delay * 1000),
+            },
+        )
+
+        self.declared[attempt] = queue_name
+        return queue_name
+
+    async def __publish(self, queue_name: str, body: bytes, headers: dict):
+        await self.channel.default_exchange.publish(
+            Message(body, headers=headers, delivery_mode=DeliveryMode.PERSISTENT),
+            routing_key=queue_name,
+        )
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import time
+
+from typing import Dict, Iterable, List, Optional
+
+
+class WorkerAnnouncement:
+    def __init__(
+        self,
+        worker_id: str,
+        assets: Iterable[str],
+        timestamp: float,
+        status: str = "ready",
+        capacity: dict = None,
+    ):
+        self.worker_id = worker_id
+        self.assets = set(assets)
+        self.timestamp = timestamp
+        self.status = status
+        self.capacity = capacity or {}
+
+    def encode(self):
+        return json.dumps(
+            {
+                "worker_id": self.worker_id,
+                "assets": sorted(self.assets),
+                "timestamp": self.timestamp,
+                "status": self.status,
+                "capacity": self.capacity,
+            }
+        ).encode()
+
+    @classmethod
+    def decode(cls, body: bytes):
+        data = json.loads(body.decode())
+        return cls(
+            data["worker_id"],
+            data["assets"],
+            data["timestamp"],
+            data.get("status", "ready"),
+            data.get("capacity"),
+        )
+
+
+class AssetDirectory:
+    def __init__(self, worker_id: str, ttl: float = 90):
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.workers: Dict[str, WorkerAnnouncement] = {}
+
+    def update(self, announcement: WorkerAnnouncement):
+        # Use the receive time so clock skew between nodes does not expire entries early
+        announcement.timestamp = time.time()
+        self.workers[announcement.worker_id] = announcement
+
+    def forget(self, worker_id: str):
+        self.workers.pop(worker_id, None)
+
+    def owners(self, asset_id: str) -> List[str]:
+        now = time.time()
+        for worker_id, announcement in list(self.workers.items()):
+            if now - announcement.timestamp > self.ttl:
+                del self.workers[worker_id]
+
+        # Draining workers keep their scenes but no longer take queries for them
+        return [
+            worker_id
+            for worker_id, announcement in self.workers.items()
+            if asset_id in announcement.assets and announcement.status == "ready"
+        ]
+
+    def owner(self, asset_id: str) -> Optional[str]:
+        owners = self.owners(asset_id)
+        if not owners:
+            return None
+
+        # Rendezvous hashing keeps an asset on the same node while spreading assets
+        # held by several nodes evenly between them
+        return max(owners, key=lambda worker_id: self.__score(asset_id, worker_id))
+
+    def __score(self, asset_id: str, worker_id: str):
+        return hashlib.sha256(f"{asset_id}:{worker_id}".encode()).digest()
@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+
+from collections import OrderedDict
+from typing import Dict, List
+
+
+class SceneNotFoundError(Exception):
+    pass
+
+
+class CameraNotFoundError(Exception):
+    pass
+
+
+class Camera:
+    def __init__(self, data: dict):
+        self.id = data["id"]
+        self.name = data["img_name"]
+        self.width = data["width"]
+        self.height = data["height"]
+        self.fx = data["fx"]
+        self.fy = data["fy"]
+        self.position = data["position"]
+        self.rotation = data["rotation"]
+
+    @property
+    def intrinsics(self):
+        return [
+            [self.fx, 0, self.width / 2],
+            [0, self.fy, self.height / 2],
+            [0, 0, 1],
+        ]
+
+    @property
+    def extrinsics(self):
+        return {"position": self.position, "rotation": self.rotation}
+
+
+class Scene:
+    def __init__(self, asset_id: str, version: tuple, cameras: List[Camera]):
+        self.asset_id = asset_id
+        self.version = version
+        self.cameras = cameras
+        self.cameras_by_name: Dict[str, Camera] = {
+            camera.name: camera for camera in cameras
+        }
+
+    def camera(self, image_name: str):
+        try:
+            return self.cameras_by_name[image_name]
+        except KeyError:
+            raise CameraNotFoundError(f"Image name {image_name} not found")
+
+    def image_index(self, image_name: str):
+        return self.camera(image_name).id
+
+
+class SceneCache:
+    cameras_path = "saga/cameras.json"
+
+    def __init__(self, capacity: int = 32):
+        self.capacity = capacity
+        self.scenes: "OrderedDict[str, Scene]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, asset_id: str, asset_path: str):
+        path = os.path.join(asset_path, self.cameras_path)
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(asset_id)
+            raise SceneNotFoundError(f"{self.cameras_path} not found")
+
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            scene = self.scenes.get(asset_id)
+            if scene is not None and scene.version == version:
+                self.scenes.move_to_end(asset_id)
+                return scene
+
+        with open(path, "r") as file:
+            cameras = [Camera(camera) for camera in json.load(file)]
+
+        scene = Scene(asset_id, version, cameras)
+
+        with self.lock:
+            self.scenes[asset_id] = scene
+            self.scenes.move_to_end(asset_id)
+            while len(self.scenes) > self.capacity:
+                self.scenes.popitem(last=False)
+
+        return scene
+
+    def invalidate(self, asset_id: str):
+        with self.lock:
+            self.scenes.pop(asset_id, None)
@@ -0,0 +1,158 @@
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+
+class GpuScheduler:
+    def __init__(
+        self,
+        slo: float = 30,
+        reserved_gpus: int = 0,
+        preemption: bool = True,
+        window: int = 100,
+    ):
+        self.slo = slo
+        self.reserved_gpus = reserved_gpus
+        self.preemption = preemption
+
+        self.processes: Dict[subprocess.Popen, Tuple[str, Set[int]]] = {}
+        self.latencies = deque(maxlen=window)
+        self.preempting: List[Set[int]] = []
+        self.paused: Set[subprocess.Popen] = set()
+        self.lock = threading.Lock()
+
+    def devices(self, priority: str, device_count: int) -> Optional[List[int]]:
+        if self.reserved_gpus <= 0 or self.reserved_gpus >= device_count:
+            return None
+
+        # The last GPUs are kept for interactive work, which may also use the others
+        reserved = list(range(device_count - self.reserved_gpus, device_count))
+        if priority == INTERACTIVE:
+            return reserved + [i for i in range(device_count) if i not in reserved]
+        return [i for i in range(device_count) if i not in reserved]
+
+    def register(self, process: subprocess.Popen, priority: str, devices: List[int]):
+        with self.lock:
+            self.processes[process] = (priority, set(devices))
+            if priority == BACKGROUND and self.__contended(set(devices)):
+                self.__signal(process, signal.SIGSTOP)
+                self.paused.add(process)
+
+    def unregister(self, process: subprocess.Popen):
+        with self.lock:
+            self.processes.pop(process, None)
+            self.paused.discard(process)
+
+    @contextmanager
+    def interactive(self, devices: List[int]):
+        # Only background work on the same GPUs is paused, as it competes for them
+        devices = set(devices)
+        preempting = False
+        with self.lock:
+            if self.preemption and self.__at_risk():
+                preempting = True
+                self.preempting.append(devices)
+                self.__pause()
+
+        try:
+            yield
+        finally:
+            if preempting:
+                with self.lock:
+                    self.preempting.remove(devices)
+                    self.__resume()
+
+    def terminate(self, timeout: float = 30):
+        with self.lock:
+            processes = list(self.processes)
+            self.paused.clear()
+
+        if processes:
+            logging.info(f"Terminating {len(processes)} model processes")
+
+        # Stopped processes only handle SIGTERM once they are continued
+        for process in processes:
+            self.__signal(process, signal.SIGCONT)
+            self.__signal(process, signal.SIGTERM)
+
+        # Processes are unregistered once their output has been collected
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                remaining = [process for process in processes if process in self.processes]
+            if not remaining:
+                return
+            time.sleep(0.5)
+
+        logging.warning(f"Killing {len(remaining)} model processes after {timeout} seconds")
+        for process in remaining:
+            self.__signal(process, signal.SIGKILL)
+
+    def record_latency(self, latency: float):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def report(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            paused = bool(self.paused)
+
+        if not latencies:
+            return {"count": 0, "paused": paused}
+
+        return {
+            "count": len(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "max": latencies[-1],
+            "paused": paused,
+        }
+
+    def __at_risk(self):
+        # Background work is paused once recent queries come close to the SLO
+        if not self.latencies:
+            return False
+
+        latencies = sorted(self.latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return p95 > self.slo * 0.8
+
+    def __pause(self):
+        background = [
+            process
+            for process, (priority, devices) in self.processes.items()
+            if priority == BACKGROUND
+            and process not in self.paused
+            and self.__contended(devices)
+        ]
+        if background:
+            logging.info(f"Pausing {len(background)} background processes for queries")
+
+        for process in background:
+            self.__signal(process, signal.SIGSTOP)
+            self.paused.add(process)
+
+    def __resume(self):
+        for process in list(self.paused):
+            if not self.__contended(self.processes[process][1]):
+                self.__signal(process, signal.SIGCONT)
+                self.paused.discard(process)
+
+    def __contended(self, devices: Set[int]):
+        return any(devices & preempting for preempting in self.preempting)
+
+    def __signal(self, process: subprocess.Popen, sig: int):
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+
+from typing import Dict, List, Tuple
+
+
+class TransferError(Exception):
+    pass
+
+
+class TransferQueue:
+    def __init__(self, concurrency: int = 2):
+        self.concurrency = max(1, concurrency)
+        self.semaphore = None
+        self.pending: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+
+    def enqueue(self, job_id: str, name: str, func, *args):
+        logging.info(f"└- Queued {name} transfer")
+        task = asyncio.ensure_future(self.__transfer(func, *args))
+        self.pending.setdefault(job_id, []).append((name, task))
+
+    def size(self, job_id: str = None):
+        if job_id is not None:
+            transfers = self.pending.get(job_id, [])
+        else:
+            transfers = [item for items in self.pending.values() for item in items]
+        return len([task for _, task in transfers if not task.done()])
+
+    async def drain(self, job_id: str):
+        transfers = self.pending.pop(job_id, [])
+        if not transfers:
+            return
+
+        if any(not task.done() for _, task in transfers):
+            logging.info(f"Waiting for {len(transfers)} transfers of job {job_id}...")
+
+        results = await asyncio.gather(
+            *[task for _, task in transfers], return_exceptions=True
+        )
+
+        failures = [
+            (name, result)
+            for (name, _), result in zip(transfers, results)
+            if isinstance(result, Exception)
+        ]
+        if failures:
+            # The first failure is kept as the cause so retries can tell what went wrong
+            message = "; ".join(f"{name}: {error}" for name, error in failures)
+            raise TransferError(message) from failures[0][1]
+
+    async def __transfer(self, func, *args):
+        # Created lazily so it binds to the running event loop
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self.semaphore:
+            return await func(*args)
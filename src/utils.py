@@ -1,12 +1,19 @@
 import pynvml
 
 
-def pick_available_gpus(count=2):
+def gpu_count():
+    pynvml.nvmlInit()
+    device_count = pynvml.nvmlDeviceGetCount()
+    pynvml.nvmlShutdown()
+    return device_count
+
+
+def pick_available_gpus(count=2, candidates=None):
     pynvml.nvmlInit()
     device_count = pynvml.nvmlDeviceGetCount()
 
     usage_info = []
-    for i in range(device_count):
+    for i in candidates if candidates is not None else range(device_count):
         handle = pynvml.nvmlDeviceGetHandleByIndex(i)
         memory_info = pynvml.nvmlDeviceGetMemoryInfo(handle)
         compute_util = pynvml.nvmlDeviceGetUtilizationRates(handle)
@@ -0,0 +1,108 @@
+import asyncio
+
+from batching import QueryBatcher
+
+
+def run(handler, submissions, max_size: int = 8):
+    async def main():
+        batcher = QueryBatcher(handler=handler, max_size=max_size)
+
+        async def submit(query, delay: float):
+            await asyncio.sleep(delay)
+            return await batcher.submit("asset", query)
+
+        return await asyncio.gather(
+            *[submit(query, delay) for query, delay in submissions], return_exceptions=True
+        )
+
+    return asyncio.run(main())
+
+
+def test_queries_arriving_during_a_batch_share_the_next_one():
+    batches = []
+
+    async def handler(asset_id, queries, respond):
+        batches.append(list(queries))
+        await asyncio.sleep(0.1)
+        return [query * 10 for query in queries]
+
+    results = run(handler, [(0, 0), (1, 0.02), (2, 0.02), (3, 0.02)])
+
+    assert batches == [[0], [1, 2, 3]]
+    assert results == [0, 10, 20, 30]
+
+
+def test_batches_are_capped_at_max_size():
+    batches = []
+
+    async def handler(asset_id, queries, respond):
+        batches.append(list(queries))
+        await asyncio.sleep(0.05)
+        return queries
+
+    run(handler, [(0, 0)] + [(i, 0.01) for i in range(1, 8)], max_size=3)
+
+    assert batches == [[0], [1, 2, 3], [4, 5, 6], [7]]
+
+
+def test_responded_queries_do_not_wait_for_the_batch():
+    finished = {}
+
+    async def handler(asset_id, queries, respond):
+        for index, query in enumerate(queries):
+            await asyncio.sleep(0.05)
+            respond(index, query)
+        await asyncio.sleep(0.5)
+        return queries
+
+    async def main():
+        batcher = QueryBatcher(handler=handler)
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+
+        async def submit(query):
+            await batcher.submit("asset", query)
+            finished[query] = loop.time() - start
+
+        await asyncio.gather(submit("a"), submit("b"))
+
+    asyncio.run(main())
+
+    assert finished["a"] < finished["b"] < 0.3
+
+
+def test_errors_are_returned_to_their_own_query():
+    async def handler(asset_id, queries, respond):
+        return [ValueError(query) if query == "bad" else query for query in queries]
+
+    results = run(handler, [("good", 0), ("bad", 0)])
+
+    assert results[0] == "good"
+    assert isinstance(results[1], ValueError)
+
+
+def test_handler_failure_fails_the_whole_batch():
+    async def handler(asset_id, queries, respond):
+        raise RuntimeError("crashed")
+
+    results = run(handler, [("a", 0), ("b", 0)])
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_assets_are_batched_separately():
+    batches = []
+
+    async def handler(asset_id, queries, respond):
+        batches.append((asset_id, list(queries)))
+        return queries
+
+    async def main():
+        batcher = QueryBatcher(handler=handler)
+        await asyncio.gather(
+            batcher.submit("a", 1), batcher.submit("b", 2), batcher.submit("a", 3)
+        )
+
+    asyncio.run(main())
+
+    assert sorted(batches) == [("a", [1, 3]), ("b", [2])]
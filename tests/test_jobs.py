@@ -0,0 +1,138 @@
+import pytest
+
+from jobs import JobStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+@pytest.fixture
+def store(path):
+    return JobStore(path)
+
+
+def test_new_submission_is_claimed(store):
+    assert store.claim("a", {"asset_id": "a"}, message_id="m1") == "claimed"
+
+    job = store.get("a")
+    assert job["status"] == "running"
+    assert job["stage"] is None
+    assert job["attempts"] == 1
+
+
+def test_retry_resumes_from_last_stage(store):
+    store.claim("a", {}, message_id="m1")
+    store.advance("a", "pointcloud")
+    store.fail("a", "boom")
+
+    assert store.claim("a", {}, resume=True) == "claimed"
+
+    job = store.get("a")
+    assert job["stage"] == "pointcloud"
+    assert job["attempts"] == 2
+    assert job["error"] is None
+    assert store.reached("a", "downloaded")
+    assert not store.reached("a", "gaussian")
+
+
+def test_same_message_id_resumes(store):
+    store.claim("a", {}, message_id="m1")
+    store.advance("a", "gaussian")
+
+    store.claim("a", {}, message_id="m1")
+
+    assert store.get("a")["stage"] == "gaussian"
+
+
+def test_resubmission_starts_over(store):
+    store.claim("a", {}, message_id="m1")
+    store.advance("a", "saga")
+    store.publish("a", "saga")
+    store.complete("a")
+
+    assert store.claim("a", {}, message_id="m2") == "claimed"
+
+    job = store.get("a")
+    assert job["stage"] is None
+    assert job["attempts"] == 1
+    assert job["message_id"] == "m2"
+    assert not store.published("a", "saga")
+
+
+def test_resumed_completed_job_is_skipped(store):
+    store.claim("a", {}, message_id="m1")
+    store.complete("a")
+
+    assert store.claim("a", {}, resume=True) == "completed"
+    assert store.claim("a", {}, message_id="m1") == "completed"
+
+
+def test_duplicate_of_active_job_is_skipped(store):
+    store.claim("a", {}, message_id="m1")
+
+    assert store.claim("a", {}, resume=True, active=True) == "active"
+    assert store.get("a")["attempts"] == 1
+
+
+def test_dead_job_resets_attempts(store):
+    store.claim("a", {})
+    store.fail("a", "boom", dead=True)
+
+    store.claim("a", {}, resume=True)
+
+    assert store.get("a")["attempts"] == 1
+
+
+def test_release_does_not_use_an_attempt(store):
+    store.claim("a", {})
+    store.release("a")
+
+    job = store.get("a")
+    assert job["status"] == "released"
+    assert job["attempts"] == 0
+
+    store.claim("a", {}, resume=True)
+    assert store.get("a")["attempts"] == 1
+
+
+def test_orphaned_jobs_are_recovered_once(path):
+    store = JobStore(path)
+    store.claim("running", {"asset_id": "running"})
+    store.claim("released", {"asset_id": "released"})
+    store.release("released")
+    store.claim("completed", {})
+    store.complete("completed")
+    store.claim("failed", {})
+    store.fail("failed", "boom")
+
+    store = JobStore(path)
+    orphaned = store.orphaned()
+    assert sorted(job["asset_id"] for job in orphaned) == ["released", "running"]
+    assert {job["asset_id"]: job["payload"] for job in orphaned}["running"] == (
+        '{"asset_id": "running"}'
+    )
+
+    for job in orphaned:
+        store.hand_off(job["asset_id"])
+
+    assert JobStore(path).orphaned() == []
+
+
+def test_handed_off_job_resumes_when_it_comes_back(store):
+    store.claim("a", {})
+    store.advance("a", "gaussian")
+    store.hand_off("a")
+
+    assert store.claim("a", {}, resume=True) == "claimed"
+    assert store.get("a")["stage"] == "gaussian"
+
+
+def test_retrying_lists_failed_jobs_only(store):
+    for asset_id in ["failed", "dead", "running"]:
+        store.claim(asset_id, {})
+    store.fail("failed", "boom")
+    store.fail("dead", "boom", dead=True)
+
+    assert store.retrying() == ["failed"]
@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+import pytest
+
+from pointclouds import (
+    PointCloudConverter,
+    PointCloudError,
+    output_dtype,
+    read_header,
+    s3dis_palette,
+    sh_c0,
+)
+
+lidar_dtype = np.dtype(
+    [("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("red", "u1"), ("green", "u1"), ("blue", "u1")]
+)
+
+gaussian_dtype = np.dtype(
+    [(name, "<f4") for name in ["x", "y", "z", "f_dc_0", "f_dc_1", "f_dc_2", "opacity"]]
+)
+
+ply_names = {"<f4": "float", "|u1": "uchar"}
+
+
+def cloud(dtype: np.dtype, count: int, seed: int = 0):
+    random = np.random.default_rng(seed)
+    points = np.zeros(count, dtype=dtype)
+    for name in dtype.names:
+        if dtype[name].kind == "u":
+            points[name] = random.integers(0, 256, count)
+        else:
+            points[name] = random.normal(0, 5, count).round(3)
+    return points
+
+
+def write_ply(path: str, points: np.ndarray, ascii: bool = False):
+    fmt = "ascii" if ascii else "binary_little_endian"
+    header = ["ply", f"format {fmt} 1.0", "comment synthetic", f"element vertex {len(points)}"]
+    header += [
+        f"property {ply_names[points.dtype[name].str]} {name}" for name in points.dtype.names
+    ]
+    header += ["element face 0", "property list uchar int vertex_indices", "end_header", ""]
+
+    with open(path, "wb") as f:
+        f.write("\n".join(header).encode("ascii"))
+        if ascii:
+            for point in points:
+                f.write((" ".join(str(value) for value in point) + "\n").encode("ascii"))
+        else:
+            f.write(points.tobytes())
+    return path
+
+
+def read_room(data_path: str):
+    room_path = os.path.join(data_path, "scene/scene/scene")
+    with open(os.path.join(room_path, "scene.txt")) as f:
+        rows = np.array([line.split() for line in f], dtype=np.float64)
+    return room_path, rows
+
+
+def read_output(path: str):
+    fmt, dtype, count, offset = read_header(path)
+    assert fmt == "binary_little_endian"
+    assert dtype == output_dtype
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return np.frombuffer(f.read(), dtype=output_dtype)
+
+
+@pytest.fixture(params=[1, 2], ids=["serial", "pool"])
+def converter(request):
+    converter = PointCloudConverter(workers=request.param, chunk_size=7)
+    yield converter
+    converter.shutdown()
+
+
+def test_header_is_parsed(tmp_path):
+    points = cloud(lidar_dtype, 5)
+    path = write_ply(str(tmp_path / "cloud.ply"), points)
+
+    fmt, dtype, count, offset = read_header(path)
+
+    assert fmt == "binary_little_endian"
+    assert dtype == lidar_dtype
+    assert count == 5
+    assert offset == os.path.getsize(path) - points.nbytes
+
+
+def test_non_ply_files_are_rejected(tmp_path):
+    path = tmp_path / "cloud.ply"
+    path.write_text("not a ply\n")
+
+    with pytest.raises(PointCloudError):
+        read_header(str(path))
+
+
+def test_lidar_cloud_converts_to_s3dis(tmp_path, converter):
+    points = cloud(lidar_dtype, 30)
+    path = write_ply(str(tmp_path / "lidar.ply"), points)
+    data_path = str(tmp_path / "data")
+
+    converter.to_s3dis(path, data_path, "scene")
+
+    room_path, rows = read_room(data_path)
+    assert rows.shape == (30, 6)
+    np.testing.assert_allclose(rows[:, 0], points["x"], atol=1e-5)
+    np.testing.assert_allclose(rows[:, 2], points["z"], atol=1e-5)
+    np.testing.assert_array_equal(rows[:, 3], points["red"])
+    np.testing.assert_array_equal(rows[:, 5], points["blue"])
+
+    with open(os.path.join(room_path, "Annotations/clutter_1.txt")) as f:
+        assert len(f.readlines()) == 30
+    with open(os.path.join(data_path, "scene/scene/scene_alignmentAngle.txt")) as f:
+        assert f.read().splitlines()[1] == "scene 1 0"
+    assert not [name for name in os.listdir(room_path) if name.endswith(".part")]
+
+
+def test_gaussian_colours_come_from_spherical_harmonics(tmp_path, converter):
+    points = cloud(gaussian_dtype, 10)
+    path = write_ply(str(tmp_path / "gaussian.ply"), points)
+    data_path = str(tmp_path / "data")
+
+    converter.to_s3dis(path, data_path, "scene")
+
+    _, rows = read_room(data_path)
+    expected = (np.clip(0.5 + sh_c0 * points["f_dc_0"], 0, 1) * 255).astype(np.uint8)
+    np.testing.assert_array_equal(rows[:, 3], expected)
+
+
+def test_ascii_and_binary_clouds_convert_the_same(tmp_path):
+    points = cloud(lidar_dtype, 20)
+    converter = PointCloudConverter(workers=1, chunk_size=6)
+
+    binary_path = write_ply(str(tmp_path / "binary.ply"), points)
+    ascii_path = write_ply(str(tmp_path / "ascii.ply"), points, ascii=True)
+    converter.to_s3dis(binary_path, str(tmp_path / "binary"), "scene")
+    converter.to_s3dis(ascii_path, str(tmp_path / "ascii"), "scene")
+
+    _, binary_rows = read_room(str(tmp_path / "binary"))
+    _, ascii_rows = read_room(str(tmp_path / "ascii"))
+    np.testing.assert_array_equal(binary_rows, ascii_rows)
+
+
+def test_conversion_can_be_repeated(tmp_path):
+    points = cloud(lidar_dtype, 10)
+    path = write_ply(str(tmp_path / "lidar.ply"), points)
+    data_path = str(tmp_path / "data")
+    converter = PointCloudConverter(workers=1)
+
+    converter.to_s3dis(path, data_path, "scene")
+    converter.to_s3dis(path, data_path, "scene")
+
+    _, rows = read_room(data_path)
+    assert rows.shape == (10, 6)
+
+
+def test_labels_reconstruct_a_coloured_cloud(tmp_path, converter):
+    points = cloud(lidar_dtype, 30)
+    path = write_ply(str(tmp_path / "lidar.ply"), points)
+    labels = np.random.default_rng(1).integers(-1, len(s3dis_palette) + 1, 30)
+    labels_path = str(tmp_path / "labels.npy")
+    np.save(labels_path, labels)
+
+    converter.reconstruct(path, labels_path, str(tmp_path / "segmentation"), "ptv3")
+
+    output = read_output(str(tmp_path / "segmentation/ptv3.ply"))
+    np.testing.assert_array_equal(output["x"], points["x"])
+    np.testing.assert_array_equal(output["label"], labels)
+
+    known = (labels >= 0) & (labels < len(s3dis_palette))
+    np.testing.assert_array_equal(output["red"][known], s3dis_palette[labels[known], 0])
+    assert not output["red"][~known].any()
+    assert not output["green"][~known].any()
+
+
+def test_label_scores_are_reduced_to_the_best_class(tmp_path):
+    points = cloud(lidar_dtype, 4)
+    path = write_ply(str(tmp_path / "lidar.ply"), points)
+    scores = np.zeros((4, len(s3dis_palette)), dtype=np.float32)
+    scores[np.arange(4), [3, 0, 12, 5]] = 1
+    labels_path = str(tmp_path / "scores.npy")
+    np.save(labels_path, scores)
+
+    PointCloudConverter(workers=1).reconstruct(
+        path, labels_path, str(tmp_path / "segmentation"), "ptv3"
+    )
+
+    output = read_output(str(tmp_path / "segmentation/ptv3.ply"))
+    np.testing.assert_array_equal(output["label"], [3, 0, 12, 5])
+
+
+def test_label_count_must_match_the_cloud(tmp_path):
+    path = write_ply(str(tmp_path / "lidar.ply"), cloud(lidar_dtype, 5))
+    labels_path = str(tmp_path / "labels.npy")
+    np.save(labels_path, np.zeros(4, dtype=np.int64))
+
+    with pytest.raises(PointCloudError):
+        PointCloudConverter(workers=1).reconstruct(
+            path, labels_path, str(tmp_path / "segmentation"), "ptv3"
+        )
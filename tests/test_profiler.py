@@ -0,0 +1,130 @@
+import json
+import subprocess
+
+from profiler import FakeGpuBackend, Profiler, stage_name
+
+
+def sample(time: float, utilization: float = 0, cpu: float = 0, rss: int = 0, memory: int = 0):
+    return {
+        "time": time,
+        "cpu": cpu,
+        "rss": rss,
+        "read_bytes": 10,
+        "write_bytes": 20,
+        "gpus": [
+            {"index": 0, "utilization": utilization, "memory_used": memory},
+            {"index": 1, "utilization": 0, "memory_used": memory},
+        ],
+    }
+
+
+def test_summarize_reports_peaks_and_totals():
+    stages = [
+        {
+            "stage": "train_scene",
+            "start": 0,
+            "end": 4,
+            "samples": [
+                sample(0, utilization=90, cpu=100, rss=1, memory=2),
+                sample(2, utilization=90, cpu=300, rss=5, memory=3),
+            ],
+        }
+    ]
+
+    summary = Profiler().summarize(stages)
+
+    stage = summary["stages"][0]
+    assert summary["duration"] == 4
+    assert stage["stage"] == "train_scene"
+    assert stage["duration"] == 4
+    assert stage["mean_cpu"] == 200
+    assert stage["peak_rss"] == 5
+    assert stage["peak_gpu_memory"] == 6
+    assert stage["read_bytes"] == 20
+    assert stage["write_bytes"] == 40
+    assert stage["gpu_idle"] == 0
+
+
+def test_summarize_finds_gpu_idle_periods():
+    utilizations = [90, 0, 0, 0, 90, 0, 90, 0, 0]
+    stages = [
+        {
+            "stage": "train_scene",
+            "start": 0,
+            "end": 18,
+            "samples": [
+                sample(2 * i, utilization=utilization)
+                for i, utilization in enumerate(utilizations)
+            ],
+        }
+    ]
+
+    stage = Profiler(idle_utilization=5, idle_gap=5).summarize(stages)["stages"][0]
+
+    # The shorter idle periods at 10 and from 14 to the end are ignored
+    assert stage["idle_gaps"] == [[2, 8]]
+    assert stage["gpu_idle"] == 6
+
+
+def test_summarize_finds_idle_time_at_the_end_of_a_stage():
+    stages = [
+        {
+            "stage": "render",
+            "start": 0,
+            "end": 10,
+            "samples": [sample(0, utilization=90), sample(2), sample(4)],
+        }
+    ]
+
+    stage = Profiler(idle_gap=5).summarize(stages)["stages"][0]
+
+    assert stage["idle_gaps"] == [[2, 10]]
+
+
+def test_summarize_finds_gaps_between_stages():
+    stages = [
+        {"stage": "convert", "start": 0, "end": 2, "samples": []},
+        {"stage": "colmap", "start": 3, "end": 5, "samples": []},
+        {"stage": "train", "start": 15, "end": 20, "samples": []},
+    ]
+
+    summary = Profiler(idle_gap=5).summarize(stages)
+
+    assert summary["duration"] == 20
+    assert summary["idle_gaps"] == [[5, 15]]
+    assert summary["stages"][0]["mean_cpu"] == 0
+    assert summary["stages"][0]["peak_gpu_memory"] == 0
+
+
+def test_fake_backend_cycles_through_values():
+    backend = FakeGpuBackend(utilization=[90, 0], memory_used=[1])
+
+    samples = [backend.sample([0, 1]) for _ in range(3)]
+
+    assert [s[0]["utilization"] for s in samples] == [90, 0, 90]
+    assert [gpu["index"] for gpu in samples[0]] == [0, 1]
+
+
+def test_profile_saves_a_timeline(tmp_path):
+    profiler = Profiler(
+        output_path=str(tmp_path), interval=0.05, gpu_backend=FakeGpuBackend([0, 90])
+    )
+
+    process = subprocess.Popen(["sleep", "0.3"])
+    with profiler.profile("job", "sleep", process.pid, [0]):
+        process.wait()
+
+    path = profiler.save("job")
+
+    with open(path) as f:
+        profile = json.load(f)
+    assert profile["job_id"] == "job"
+    assert [stage["stage"] for stage in profile["stages"]] == ["sleep"]
+    assert len(profile["stages"][0]["samples"]) > 1
+    assert all("gpus" in s for s in profile["stages"][0]["samples"])
+    assert profiler.save("job") is None
+
+
+def test_stage_name():
+    assert stage_name("python models/saga/train_scene.py -s assets/a") == "train_scene"
+    assert stage_name("colmap model_converter --input_path a") == "colmap model_converter"
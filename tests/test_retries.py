@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from retries import RetryPolicy, RetryQueue
+
+
+class FakeExchange:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key: str):
+        self.published.append((routing_key, message))
+
+
+class FakeChannel:
+    def __init__(self):
+        self.default_exchange = FakeExchange()
+        self.queues = {}
+
+    async def declare_queue(self, name: str, durable: bool = False, arguments=None):
+        self.queues[name] = arguments
+
+
+@pytest.fixture
+def channel():
+    return FakeChannel()
+
+
+@pytest.fixture
+def retries(channel):
+    return RetryQueue(channel, "process", RetryPolicy(attempts=3, base_delay=60, max_delay=3600))
+
+
+def test_policy_delay_backs_off_up_to_the_maximum():
+    policy = RetryPolicy(attempts=10, base_delay=2, max_delay=60)
+
+    assert [policy.delay(attempt, jitter=False) for attempt in range(1, 7)] == [
+        2, 4, 8, 16, 32, 60
+    ]
+    assert 1.8 <= policy.delay(1) <= 2.2
+
+
+def test_policy_retries_until_success():
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("reset")
+        return "done"
+
+    policy = RetryPolicy(attempts=3, base_delay=0, max_delay=0)
+    assert asyncio.run(policy.run(flaky)) == "done"
+    assert len(calls) == 3
+
+
+def test_policy_gives_up_after_the_last_attempt():
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        raise ConnectionError("reset")
+
+    policy = RetryPolicy(attempts=2, base_delay=0, max_delay=0)
+    with pytest.raises(ConnectionError):
+        asyncio.run(policy.run(failing))
+    assert len(calls) == 2
+
+
+def test_policy_does_not_retry_rejected_errors():
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    policy = RetryPolicy(attempts=5, base_delay=0, max_delay=0)
+    with pytest.raises(ValueError):
+        asyncio.run(policy.run(failing, retry_if=lambda e: isinstance(e, ConnectionError)))
+    assert len(calls) == 1
+
+
+def test_retry_goes_through_a_delayed_queue(channel, retries):
+    assert asyncio.run(retries.retry(b"body", 1, "boom", {"x-resume": True}))
+
+    routing_key, message = channel.default_exchange.published[0]
+    assert routing_key == "process.retry.60s"
+    assert message.body == b"body"
+    assert message.headers == {"x-resume": True, "x-attempts": 1, "x-failure-reason": "boom"}
+    assert channel.queues["process.retry.60s"] == {
+        "x-dead-letter-exchange": "",
+        "x-dead-letter-routing-key": "process",
+        "x-message-ttl": 60000,
+    }
+
+
+def test_each_attempt_gets_its_own_delay(channel, retries):
+    asyncio.run(retries.retry(b"body", 1, "boom"))
+    asyncio.run(retries.retry(b"body", 2, "boom"))
+    asyncio.run(retries.retry(b"body", 1, "boom"))
+
+    assert [key for key, _ in channel.default_exchange.published] == [
+        "process.retry.60s",
+        "process.retry.120s",
+        "process.retry.60s",
+    ]
+    assert sorted(channel.queues) == ["process.retry.120s", "process.retry.60s"]
+
+
+def test_last_attempt_is_dead_lettered(channel, retries):
+    assert not asyncio.run(retries.retry(b"body", 3, "boom"))
+
+    routing_key, message = channel.default_exchange.published[0]
+    assert routing_key == "process.dead"
+    assert message.headers["x-attempts"] == 3
+
+
+def test_permanent_failure_is_dead_lettered_right_away(channel, retries):
+    assert not asyncio.run(retries.retry(b"body", 1, "not found", permanent=True))
+
+    assert [key for key, _ in channel.default_exchange.published] == ["process.dead"]
+    assert channel.queues == {}